@@ -0,0 +1,147 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import tracing
+
+# Một event loop nền dùng chung cho cả process: mọi lượt chat của mọi session
+# chạy như task trên loop này thay vì giữ một thread riêng cho mỗi lượt.
+BLOCKING_WORKERS = int(os.getenv("ASYNC_BLOCKING_WORKERS", "16"))
+
+_loop = None
+_lock = threading.Lock()
+_inflight = {}
+# Các lời gọi blocking (cache SQLite + HTTP pool) chạy trên executor giới hạn này
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+def get_loop():
+    """Khởi động event loop nền (lazy) và trả về nó."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def backlog():
+    """Số lời gọi blocking đang chờ một worker rảnh trên executor dùng chung."""
+    return _executor._work_queue.qsize()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Chạy hàm blocking trên executor dùng chung mà không chặn event loop."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(context.run, func, *args, **kwargs))
+
+
+async def _in_context(coro, context):
+    # Task trên loop nền không kế thừa contextvars của thread gọi submit (span tracing đang mở...)
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def submit(coro, session_id=None):
+    """Đưa coroutine lên loop nền; task còn dở trước đó của cùng session (nếu có) bị hủy.
+
+    Wrapper đồng bộ chặn tới khi lượt xong nên lượt chat bị bỏ dở chỉ được hủy khi
+    UI gọi cancel(session_id) (main.py làm vậy khi Streamlit dừng lượt đang stream).
+    """
+    future = asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), get_loop())
+    if session_id is not None:
+        with _lock:
+            previous = _inflight.get(session_id)
+            _inflight[session_id] = future
+        if previous is not None and not previous.done():
+            previous.cancel()
+        future.add_done_callback(partial(_forget, session_id))
+    return future
+
+
+def _forget(session_id, future):
+    with _lock:
+        if _inflight.get(session_id) is future:
+            del _inflight[session_id]
+
+
+def run(coro, session_id=None):
+    """Wrapper đồng bộ: chạy coroutine trên loop nền và chờ kết quả."""
+    return submit(coro, session_id).result()
+
+
+def cancel(session_id):
+    """Hủy lượt đang chạy của một session (nếu có)."""
+    with _lock:
+        future = _inflight.pop(session_id, None)
+    if future is not None:
+        future.cancel()
+
+
+async def _anext(iterator):
+    try:
+        return False, await iterator.__anext__()
+    except StopAsyncIteration:
+        return True, None
+
+
+def iterate(async_iterable, session_id=None):
+    """Wrapper đồng bộ cho async iterator: lấy từng phần tử từ loop nền."""
+    iterator = async_iterable.__aiter__()
+    try:
+        while True:
+            done, item = run(_anext(iterator), session_id)
+            if done:
+                return
+            yield item
+    finally:
+        if hasattr(iterator, "aclose"):
+            submit(iterator.aclose())
+
+
+class StreamError(str):
+    """Đoạn text báo lỗi cuối stream: vẫn hiển thị như text nhưng cho biết stream đã hỏng giữa chừng."""
+
+
+async def stream_text(response, error_prefix):
+    """Chuyển response stream của Gemini thành async generator các đoạn text."""
+    span = tracing.start_span("generate.stream")
+    chunks = 0
+    try:
+        async for chunk in response:
+            if chunk.parts:
+                if not chunks:
+                    span.set(first_chunk_ms=round((time.perf_counter() - span.start) * 1000, 2))
+                chunks += 1
+                yield chunk.text
+    except Exception as e:
+        span.error = str(e)
+        yield StreamError(f"{error_prefix}: {str(e)}")
+    finally:
+        span.set(chunks=chunks)
+        span.finish()
+
+
+def iter_text(response, error_prefix):
+    """Phiên bản đồng bộ của stream_text cho generate_content(stream=True)."""
+    try:
+        for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+    except Exception as e:
+        yield StreamError(f"{error_prefix}: {str(e)}")
+
+
+def run_streamable(coro, session_id=None):
+    """Như run(); nếu kết quả là async iterator thì trả về generator đồng bộ tương ứng."""
+    result = run(coro, session_id)
+    if hasattr(result, "__aiter__"):
+        return iterate(result, session_id)
+    return result
@@ -0,0 +1,116 @@
+import argparse
+import inspect
+import json
+import sys
+import time
+
+import numpy as np
+
+import runtime
+
+# Định tuyến hàng loạt: encode theo batch và tính similarity dạng ma trận với
+# toàn bộ utterance, cho kết quả giống rl(query) nhưng nhanh hơn nhiều khi xử lý log/tập đánh giá.
+DEFAULT_BATCH_SIZE = 64
+TOP_K = 5  # giống RouteLayer._retrieve
+
+
+def _encode(encoder, docs):
+    if "batch_size" in inspect.signature(encoder.__call__).parameters:
+        return encoder(docs, batch_size=len(docs))
+    return encoder(docs)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def route_batch(queries, batch_size=DEFAULT_BATCH_SIZE, layer=None):
+    """Định tuyến một danh sách query; trả về list {"route": tên route hoặc None, "score": float}.
+
+    Cùng quy tắc với RouteLayer: lấy TOP_K utterance gần nhất, cộng điểm theo route,
+    route thắng phải có điểm cao nhất vượt score_threshold của route đó.
+    """
+    layer = layer or runtime.get_route_layer()
+    index = _normalize(np.asarray(layer.index, dtype=np.float32))
+    route_names = [route.name for route in layer.routes]
+    thresholds = np.array([route.score_threshold for route in layer.routes], dtype=np.float32)
+    # one_hot[i, r] = utterance i thuộc route r
+    one_hot = (np.asarray(layer.categories)[:, None] == np.array(route_names)[None, :])
+    top_k = min(TOP_K, index.shape[0])
+
+    # Sắp theo độ dài để mỗi batch ít padding hơn, sau đó trả về đúng thứ tự ban đầu
+    order = sorted(range(len(queries)), key=lambda i: len(queries[i]))
+    results = [None] * len(queries)
+    for start in range(0, len(order), batch_size):
+        batch_ids = order[start:start + batch_size]
+        embeddings = np.asarray(_encode(layer.encoder, [queries[i] for i in batch_ids]), dtype=np.float32)
+        sims = _normalize(embeddings) @ index.T                      # (B, N)
+
+        top_idx = np.argpartition(sims, -top_k, axis=1)[:, -top_k:]
+        mask = np.zeros_like(sims, dtype=bool)
+        np.put_along_axis(mask, top_idx, True, axis=1)
+        top_sims = np.where(mask, sims, 0.0)
+
+        totals = top_sims @ one_hot                                  # (B, R) tổng điểm theo route
+        in_top = mask[:, :, None] & one_hot[None, :, :]              # (B, N, R)
+        best = np.where(in_top, sims[:, :, None], -np.inf).max(axis=1)  # (B, R) điểm cao nhất theo route
+        totals = np.where(np.isfinite(best), totals, -np.inf)
+        winners = totals.argmax(axis=1)
+
+        for row, query_id in enumerate(batch_ids):
+            winner = winners[row]
+            score = float(best[row, winner])
+            passed = score > thresholds[winner]
+            results[query_id] = {"route": route_names[winner] if passed else None, "score": score}
+    return results
+
+
+def _read_queries(path, field):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            records.append(record if isinstance(record, dict) else {field: record})
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Route queries from a JSONL file in batches.")
+    parser.add_argument("input", help="JSONL file, one object (or string) per line")
+    parser.add_argument("output", help="JSONL file to write, each input record plus route/score")
+    parser.add_argument("--field", default="query", help="field holding the query text")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--compare", type=int, default=0, metavar="N",
+                        help="also time the first N queries through rl() one at a time")
+    args = parser.parse_args(argv)
+
+    records = _read_queries(args.input, args.field)
+    queries = [str(record[args.field]) for record in records]
+    layer = runtime.get_route_layer()
+
+    start = time.perf_counter()
+    results = route_batch(queries, batch_size=args.batch_size, layer=layer)
+    elapsed = time.perf_counter() - start
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        for record, result in zip(records, results):
+            f.write(json.dumps(dict(record, **result), ensure_ascii=False) + "\n")
+    print(f"batch: {len(queries)} queries in {elapsed:.2f}s ({len(queries) / max(elapsed, 1e-9):.1f} q/s)",
+          file=sys.stderr)
+
+    if args.compare:
+        sample = queries[:args.compare]
+        start = time.perf_counter()
+        for query in sample:
+            layer(query)
+        elapsed = time.perf_counter() - start
+        print(f"rl loop: {len(sample)} queries in {elapsed:.2f}s ({len(sample) / max(elapsed, 1e-9):.1f} q/s)",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
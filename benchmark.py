@@ -0,0 +1,437 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import perf_stats
+
+# Benchmark offline: thay Gemini và Open Library/Wikipedia bằng response đã ghi sẵn
+# (data/bench_fixtures.json) với độ trễ giả lập có thể cấu hình, rồi chạy router và
+# các agent trên tập query (data/bench_queries.jsonl). Kết quả lặp lại được, không cần mạng.
+FIXTURES_PATH = os.path.join("data", "bench_fixtures.json")
+QUERIES_PATH = os.path.join("data", "bench_queries.jsonl")
+TARGETS = {
+    # target -> route của các query được dùng (None = tất cả query)
+    "router": None,
+    "book_info": "book_info",
+    "recommend": "book_recommendation",
+    "small_talk": "small_talk",
+}
+CHUNK_WORDS = 8
+EXTRACTION_PROMPT = re.compile(r"Current User Input: (.*)")
+BATCH_EXTRACTION_PROMPT = re.compile(r"Request \d+ User Input: (.*)")
+ERROR_RESPONSE = re.compile(r"(gemini |wikipedia )?error", re.IGNORECASE)
+
+
+def request_key(url, params=None):
+    """Khóa của một request HTTP trong fixture: host + path + query đã sắp xếp."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + [(key, str(value)) for key, value in (params or {}).items()]
+    return f"{parts.netloc}{parts.path}?{urlencode(sorted(query))}"
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class Latency:
+    """Độ trễ giả lập: `seconds` ± `jitter` (tỉ lệ), ngẫu nhiên theo seed để lặp lại được."""
+
+    def __init__(self, seconds, jitter=0.0, seed=0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+
+    def sample(self):
+        if not self.seconds:
+            return 0.0
+        return max(0.0, self.seconds * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def sleep(self):
+        time.sleep(self.sample())
+
+    async def asleep(self):
+        await asyncio.sleep(self.sample())
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+
+
+class FakeResponse:
+    def __init__(self, url, status_code, data):
+        self.url = url
+        self.status_code = status_code
+        self._data = data
+        self.headers = {}
+
+    def json(self):
+        return self._data
+
+    @property
+    def text(self):
+        return json.dumps(self._data)
+
+    def raise_for_status(self):
+        import requests
+
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} for url: {self.url}", response=self)
+
+    def close(self):
+        pass
+
+
+class ReplaySession:
+    """Thay requests.Session của http_client; request không có trong fixture trả về 404."""
+
+    def __init__(self, fixtures, latency):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.misses = set()
+
+    def get(self, url, params=None, timeout=None):
+        self.latency.sleep()
+        key = request_key(url, params)
+        entry = self.fixtures.get(key)
+        if entry is None:
+            self.misses.add(key)
+            return FakeResponse(url, 404, {})
+        return FakeResponse(url, entry["status"], entry["json"])
+
+
+class RecordingSession:
+    """Gọi mạng thật và ghi lại response (JSON) để dùng làm fixture."""
+
+    def __init__(self, session, fixtures):
+        self.session = session
+        self.fixtures = fixtures
+
+    def get(self, url, params=None, timeout=None):
+        response = self.session.get(url, params=params, timeout=timeout)
+        try:
+            self.fixtures[request_key(url, params)] = {"status": response.status_code, "json": response.json()}
+        except ValueError:
+            pass
+        return response
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+
+class FakeGeminiResponse:
+    """Giống GenerateContentResponse ở những gì agent dùng: .text, .parts, duyệt stream sync/async."""
+
+    def __init__(self, text, chunk_latency):
+        self.text = text
+        self.parts = [text]
+        words = text.split(" ")
+        self._chunks = [" ".join(words[i:i + CHUNK_WORDS]) + " " for i in range(0, len(words), CHUNK_WORDS)]
+        self._chunk_latency = chunk_latency
+
+    def __iter__(self):
+        for text in self._chunks:
+            self._chunk_latency.sleep()
+            yield FakeChunk(text)
+
+    async def __aiter__(self):
+        for text in self._chunks:
+            await self._chunk_latency.asleep()
+            yield FakeChunk(text)
+
+
+class ReplayModel:
+    """Thay GenerativeModel: trả response đã ghi theo hash của prompt.
+
+    Prompt chưa được ghi thì prompt trích xuất (đơn hoặc gộp) lấy kết quả theo query
+    ("extractions"), các prompt khác dùng "default_response".
+    """
+
+    def __init__(self, fixtures, latency, chunk_latency):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+
+    def _text(self, prompt):
+        recorded = self.fixtures["prompts"].get(prompt_key(prompt))
+        if recorded is not None:
+            return recorded
+        batch = BATCH_EXTRACTION_PROMPT.findall(prompt)
+        if batch:
+            return json.dumps([self._extraction(query) for query in batch])
+        match = EXTRACTION_PROMPT.search(prompt)
+        if match:
+            return json.dumps(self._extraction(match.group(1)))
+        return self.fixtures["default_response"]
+
+    def _extraction(self, query):
+        info = self.fixtures["extractions"].get(query.strip())
+        return info or {"book_name": None, "author_name": None, "genre": None}
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.latency.sleep()
+        return FakeGeminiResponse(self._text(prompt), self.chunk_latency)
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        await self.latency.asleep()
+        return FakeGeminiResponse(self._text(prompt), self.chunk_latency)
+
+
+class RecordingModel:
+    """Gọi Gemini thật (không stream) và ghi lại text theo hash của prompt."""
+
+    def __init__(self, model, fixtures):
+        self.model = model
+        self.fixtures = fixtures
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        response = self.model.generate_content(prompt, **kwargs)
+        self.fixtures["prompts"][prompt_key(prompt)] = response.text
+        return response
+
+    async def generate_content_async(self, prompt, stream=False, **kwargs):
+        response = await self.model.generate_content_async(prompt, **kwargs)
+        self.fixtures["prompts"][prompt_key(prompt)] = response.text
+        return response
+
+
+# ---------------------------------------------------------------------------
+# Harness
+
+
+def isolate(args, tmp):
+    """Dùng cache/tracker/trace log tạm để lần chạy không bị ảnh hưởng bởi dữ liệu cũ (gọi trước khi import agent)."""
+    os.environ["CACHE_PATH"] = os.path.join(tmp, "responses.sqlite3")
+    os.environ["TRACKER_PATH"] = os.path.join(tmp, "book_tracker.sqlite3")
+    os.environ["TRACE_LOG"] = ""
+    if not args.catalog:
+        os.environ["CATALOG_PATH"] = os.path.join(tmp, "no-catalog.sqlite3")
+
+
+def _install(args, fixtures):
+    import http_client
+    import runtime
+
+    if args.record:
+        http_client.set_session(RecordingSession(http_client.get_session(), fixtures["http"]))
+        runtime.override_gemini_model(RecordingModel(runtime.get_gemini_model(), fixtures["gemini"]))
+        return None
+    session = ReplaySession(fixtures["http"], Latency(args.http_latency, args.jitter, args.seed))
+    http_client.set_session(session)
+    runtime.override_gemini_model(ReplayModel(
+        fixtures["gemini"],
+        Latency(args.gemini_latency, args.jitter, args.seed + 1),
+        Latency(args.chunk_latency, args.jitter, args.seed + 2),
+    ))
+    return session
+
+
+def reset_caches():
+    import open_library
+    from response_cache import response_cache
+    from semantic_cache import semantic_cache
+
+    response_cache.clear()
+    semantic_cache.clear()
+    open_library.clear_work_details()
+
+
+def _targets():
+    from book_info_agent import get_book_info
+    from book_recommendation_agent import recommend_books
+    from chat_router import router
+    from small_talk_agent import small_talker
+
+    return {
+        "router": router,
+        "book_info": get_book_info,
+        "recommend": recommend_books,
+        "small_talk": small_talker,
+    }
+
+
+def _call(func, query, stream):
+    """Chạy một query; trả về (độ trễ, thời gian tới chunk đầu tiên, có lỗi hay không)."""
+    start = time.perf_counter()
+    first_chunk = None
+    try:
+        response = func(query, [], stream=stream)
+        if not isinstance(response, str):
+            parts = []
+            for chunk in response:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - start
+                parts.append(chunk)
+            response = "".join(parts)
+        failed = bool(ERROR_RESPONSE.match(response))
+    except Exception as e:
+        print(f"[ERROR] {query!r}: {e}", file=sys.stderr)
+        failed = True
+    return time.perf_counter() - start, first_chunk, failed
+
+
+def run_target(name, func, queries, args):
+    for query in queries[:args.warmup]:
+        _call(func, query, args.stream)
+
+    latencies, first_chunks, errors = [], [], 0
+    if args.memory:
+        tracemalloc.reset_peak()
+    random.seed(args.seed)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for query in queries:
+            if not args.warm_cache:
+                reset_caches()
+            latency, first_chunk, failed = _call(func, query, args.stream)
+            latencies.append(latency)
+            if first_chunk is not None:
+                first_chunks.append(first_chunk)
+            errors += failed
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = perf_stats.percentiles(latencies)
+    result = {
+        "queries": len(latencies),
+        "errors": errors,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "throughput_qps": len(latencies) / elapsed,
+    }
+    if first_chunks:
+        result["first_chunk_p50_ms"] = perf_stats.percentiles(first_chunks)[0] * 1000
+    if args.memory:
+        result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    return result
+
+
+def _print_report(results, baseline=None):
+    header = f"{'target':12} {'n':>4} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'q/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results["targets"].items():
+        line = (f"{name:12} {result['queries']:>4} {result['errors']:>4} {result['p50_ms']:>9.1f} "
+                f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['throughput_qps']:>8.2f}")
+        if "first_chunk_p50_ms" in result:
+            line += f"  first chunk p50 {result['first_chunk_p50_ms']:.1f}ms"
+        if "peak_traced_mb" in result:
+            line += f"  peak {result['peak_traced_mb']:.1f}MB"
+        previous = (baseline or {}).get("targets", {}).get(name)
+        if previous:
+            line += f"  (p50 {_change(previous['p50_ms'], result['p50_ms'])}, p95 {_change(previous['p95_ms'], result['p95_ms'])})"
+        print(line)
+    if results["peak_rss_mb"] is not None:
+        print(f"peak RSS {results['peak_rss_mb']:.1f}MB")
+    if results.get("fixture_misses"):
+        print(f"[WARN] {len(results['fixture_misses'])} requests had no fixture (served as 404):", file=sys.stderr)
+        for key in results["fixture_misses"]:
+            print(f"  {key}", file=sys.stderr)
+
+
+def _change(before, after):
+    return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+
+
+def _regressions(results, baseline, max_regression):
+    failed = []
+    for name, result in results["targets"].items():
+        previous = baseline.get("targets", {}).get(name)
+        if previous and previous["p95_ms"] and result["p95_ms"] > previous["p95_ms"] * (1 + max_regression / 100):
+            failed.append(name)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded Gemini/HTTP responses and benchmark the agents.")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed queries per target before measuring")
+    parser.add_argument("--gemini-latency", type=float, default=0.4, help="seconds per Gemini call")
+    parser.add_argument("--chunk-latency", type=float, default=0.03, help="seconds between streamed chunks")
+    parser.add_argument("--http-latency", type=float, default=0.15, help="seconds per HTTP request")
+    parser.add_argument("--jitter", type=float, default=0.2, help="random +/- fraction applied to latencies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true", help="request streamed answers and time the first chunk")
+    parser.add_argument("--warm-cache", action="store_true", help="keep response/semantic caches between queries")
+    parser.add_argument("--catalog", action="store_true", help="use the offline catalog instead of the HTTP fixtures")
+    parser.add_argument("--memory", action="store_true", help="track peak Python allocations (adds overhead)")
+    parser.add_argument("--record", action="store_true", help="call the real APIs once and save the fixtures")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, help="exit 1 if any p95 is this many percent above baseline")
+    args = parser.parse_args(argv)
+
+    with open(args.queries, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    if args.record:
+        fixtures = {"gemini": {"prompts": {}, "extractions": {}, "default_response": ""}, "http": {}}
+        if os.path.exists(args.fixtures):
+            with open(args.fixtures, encoding="utf-8") as f:
+                fixtures = json.load(f)
+        args.repeat, args.warmup = 1, 0
+    else:
+        with open(args.fixtures, encoding="utf-8") as f:
+            fixtures = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate(args, tmp)
+        session = _install(args, fixtures)
+        import runtime
+
+        runtime.get_route_layer()  # nạp encoder/route index trước khi đo
+        functions = _targets()
+        if args.memory:
+            tracemalloc.start()
+
+        results = {"config": {key: value for key, value in vars(args).items() if key not in ("json", "baseline")},
+                   "targets": {}}
+        for name in args.targets:
+            route = TARGETS[name]
+            queries = [item["query"] for item in corpus if route is None or item["route"] == route]
+            results["targets"][name] = run_target(name, functions[name], queries, args)
+        results["peak_rss_mb"] = perf_stats.peak_rss_mb()
+        results["fixture_misses"] = sorted(session.misses) if session else []
+
+    if args.record:
+        with open(args.fixtures, "w", encoding="utf-8") as f:
+            json.dump(fixtures, f, indent=1, ensure_ascii=False)
+        print(f"recorded {len(fixtures['http'])} HTTP and {len(fixtures['gemini']['prompts'])} Gemini responses")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print_report(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if baseline and args.max_regression is not None:
+        failed = _regressions(results, baseline, args.max_regression)
+        if failed:
+            print(f"p95 regression above {args.max_regression}% in: {', '.join(failed)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,19 @@
 import json
-import requests
+import async_runtime
+import budget
+import catalog
+from chat_context import format_chat_history
+import gemini_batcher
+import http_client
+import local_extractor
+import open_library
+import prefetch
 import re
+import runtime
 import time
-import os
-import urllib.parse
-from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
-import google.generativeai as genai
-
-# Cấu hình Gemini API
-load_dotenv()
-genai.configure(api_key=os.getenv("API_KEY"))
-model = genai.GenerativeModel("gemini-2.0-flash-lite")
+import tracing
+from response_cache import cached
+from semantic_cache import semantic_cache
 
 # Các ví dụ mẫu
 examples = """
@@ -25,22 +27,11 @@ Example Input: "Who wrote The Hobbit"
 Example Output: {"book_name": "The Hobbit", "author_name": null, "genre": null}
 """
 
-def format_chat_history(chat_history):
-    """Chuyển đổi lịch sử chat từ Streamlit sang định dạng văn bản"""
-    if not chat_history:
-        return ""
-    
-    history_text = ""
-    for msg in chat_history[-6:]:  # Lấy 6 tin nhắn gần nhất (khoảng 3 lượt hội thoại)
-        role = "User" if msg["role"] == "user" else "Assistant"
-        history_text += f"{role}: {msg['content']}\n"
-    return history_text
-
-def extract_book_info_gemini(user_input: str, chat_history=None):
-    """Trích xuất thông tin sách bằng Gemini, có xem xét lịch sử trò chuyện"""
+def build_extraction_prompt(user_input: str, chat_history=None):
+    """Tạo prompt trích xuất thông tin sách, có xem xét lịch sử trò chuyện"""
     history_text = format_chat_history(chat_history) if chat_history else ""
     
-    prompt = f"""
+    return f"""
     You are an intelligent assistant that extracts book-related information from user queries.
     Consider this conversation history for context:
     {history_text}
@@ -54,83 +45,122 @@ def extract_book_info_gemini(user_input: str, chat_history=None):
     Current User Input: {user_input}
     Only return JSON:
     """
+
+def parse_extraction(text):
+    """Chỉ lấy phần JSON đầu tiên trong phản hồi của Gemini"""
+    match = re.search(r'\{.*\}', text.strip(), re.DOTALL)
+    if match:
+        return json.loads(match.group(0))
+    return {"error": "No valid JSON found"}
+
+@tracing.traced("extract.gemini")
+def extract_book_info_gemini(user_input: str, chat_history=None):
+    """Trích xuất thông tin sách bằng Gemini, có xem xét lịch sử trò chuyện"""
     try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        
-        # Chỉ lấy phần JSON đầu tiên nếu có
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
-        return {"error": "No valid JSON found"}
+        response = runtime.get_gemini_model().generate_content(build_extraction_prompt(user_input, chat_history))
+        return parse_extraction(response.text)
     except Exception as e:
         return {"error": f"Gemini error: {str(e)}"}
 
+async def _aextract_one(user_input: str, chat_history=None):
+    """Phiên bản async của extract_book_info_gemini"""
+    try:
+        response = await runtime.get_gemini_model().generate_content_async(build_extraction_prompt(user_input, chat_history))
+        return parse_extraction(response.text)
+    except Exception as e:
+        return {"error": f"Gemini error: {str(e)}"}
+
+_extraction_batcher = gemini_batcher.ExtractionBatcher("book_info", examples, _aextract_one)
+
+@tracing.traced("extract.gemini")
+async def aextract_book_info_gemini(user_input: str, chat_history=None):
+    """Trích xuất bằng Gemini (async); các yêu cầu đồng thời của nhiều session được gộp thành một lời gọi"""
+    return await _extraction_batcher.submit(user_input, chat_history)
+
+@cached("openlibrary_book")
+def _lookup_open_library(book_name):
+    """Gọi Open Library, trả về None nếu không tìm thấy sách"""
+    book_data = open_library.search_first_work(book_name)
+    if book_data is None or not book_data.get("key"):
+        return None
+
+    # Chi tiết work được dùng lại nếu đã tải trong process
+    detail_data = open_library.get_work_details(book_data["key"])
+    if detail_data is None:
+        return None
+    return _book_details(book_data, detail_data)
+
+def _book_details(book_data, detail_data):
+    """Gộp doc của search.json và chi tiết work thành thông tin sách cho prompt"""
+    description = (
+        detail_data.get("description", {}).get("value")
+        if isinstance(detail_data.get("description"), dict)
+        else detail_data.get("description", "No description")
+    )
+
+    return {
+        "title": book_data.get("title", "Unknown"),
+        "author": book_data.get("author_name", ["Unknown"])[0],
+        "publish_year": book_data.get("first_publish_year", "Unknown"),
+        "description": description,
+        "subjects": detail_data.get("subjects", book_data.get("subject", [])),
+        "subject_places": detail_data.get("subject_places", []),
+        "subject_times": detail_data.get("subject_times", []),
+    }
+
+@tracing.traced("fetch.open_library")
 def search_open_library(book_name):
     """Tìm kiếm thông tin sách trên Open Library"""
-    search_url = f"https://openlibrary.org/search.json?q={urllib.parse.quote(book_name)}"
+    # Catalog offline trả lời trong vài ms, chỉ gọi mạng khi catalog không có sách
+    work = catalog.find_work(book_name)
+    if work is not None:
+        return _book_details(work, {"description": work["description"] or "No description", "subjects": work["subject"]})
     try:
-        response = requests.get(search_url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            if data["numFound"] > 0:
-                book_data = data["docs"][0]
-                work_key = book_data.get("key")
-                
-                if work_key:
-                    work_id = work_key.split("/")[-1]
-                    detail_url = f"https://openlibrary.org/works/{work_id}.json"
-                    detail_response = requests.get(detail_url, timeout=10)
-                    
-                    if detail_response.status_code == 200:
-                        detail_data = detail_response.json()
-                        description = (
-                            detail_data.get("description", {}).get("value")
-                            if isinstance(detail_data.get("description"), dict)
-                            else detail_data.get("description", "No description")
-                        )
-                        
-                        return {
-                            "title": book_data.get("title", "Unknown"),
-                            "author": book_data.get("author_name", ["Unknown"])[0],
-                            "publish_year": book_data.get("first_publish_year", "Unknown"),
-                            "description": description,
-                            "subjects": detail_data.get("subjects", []),
-                            "subject_places": detail_data.get("subject_places", []),
-                            "subject_times": detail_data.get("subject_times", []),
-                        }
-        return {"error": "Can not find infomation on Open Library"}
+        result = _lookup_open_library(book_name)
+        if result is None:
+            return {"error": "Can not find infomation on Open Library"}
+        return result
     except Exception as e:
         return {"error": f"Lỗi Open Library: {str(e)}"}
 
+@cached("wikipedia")
+def _lookup_wikipedia(book_name):
+    """Gọi Wikipedia, trả về None nếu không có trang phù hợp"""
+    params = {
+        "format": "json",
+        "action": "query",
+        "prop": "extracts",
+        "exintro": True,
+        "explaintext": True,
+        "redirects": 1,
+        "titles": book_name
+    }
+    response = http_client.get("https://en.wikipedia.org/w/api.php", params=params)
+    response.raise_for_status()
+    data = response.json()
+
+    pages = data.get("query", {}).get("pages", {})
+    for page in pages.values():
+        if "extract" in page:
+            return page["extract"][:1000]  # Giới hạn độ dài
+    return None
+
+@tracing.traced("fetch.wikipedia")
 def search_wikipedia(book_name):
     """Tìm kiếm thông tin sách trên Wikipedia"""
     try:
-        params = {
-            "format": "json",
-            "action": "query",
-            "prop": "extracts",
-            "exintro": True,
-            "explaintext": True,
-            "redirects": 1,
-            "titles": book_name
-        }
-        response = requests.get("https://en.wikipedia.org/w/api.php", params=params, timeout=10)
-        data = response.json()
-        
-        pages = data.get("query", {}).get("pages", {})
-        for page in pages.values():
-            if "extract" in page:
-                return page["extract"][:1000]  # Giới hạn độ dài
-        return {"error": "No infomation found on Wikipedia"}
+        result = _lookup_wikipedia(book_name)
+        if result is None:
+            return {"error": "No infomation found on Wikipedia"}
+        return result
     except Exception as e:
         return {"error": f"Wikipedia error: {str(e)}"}
 
-def generate_final_response(book_info, wiki_data, library_data, user_input, chat_history=None):
-    """Tạo phản hồi cuối cùng với ngữ cảnh hội thoại"""
+def build_final_prompt(book_info, wiki_data, library_data, user_input, chat_history=None, missing_sources=None):
+    """Tạo prompt cho phản hồi cuối cùng với ngữ cảnh hội thoại"""
     history_text = format_chat_history(chat_history) if chat_history else ""
     
-    prompt = f"""
+    return f"""
         You are an expert in books helping users in a conversation.
 
         User asked: "{user_input}"
@@ -145,20 +175,70 @@ def generate_final_response(book_info, wiki_data, library_data, user_input, chat
 
         Open Library Details:
         {library_data}
-
+        {budget.missing_note(missing_sources)}
         Be helpful, concise, and conversational if needed.
         If there is no information available be honest and say you don't know.
         """
+
+@tracing.traced("generate")
+def generate_final_response(book_info, wiki_data, library_data, user_input, chat_history=None, stream=False,
+                            missing_sources=None):
+    """Tạo phản hồi cuối cùng với ngữ cảnh hội thoại; stream=True trả về generator các đoạn text"""
+    prompt = build_final_prompt(book_info, wiki_data, library_data, user_input, chat_history, missing_sources)
     try:
-        response = model.generate_content(prompt)
+        response = runtime.get_gemini_model().generate_content(prompt, stream=stream)
+        if stream:
+            return async_runtime.iter_text(response, "Error when finding book infomation")
         return response.text.strip()
     except Exception as e:
         return f"Error when finding book infomation: {str(e)}"
 
-def get_book_info(query, chat_history=None):
-    """Xử lý truy vấn sách với ngữ cảnh hội thoại"""
+@tracing.traced("generate")
+async def agenerate_final_response(book_info, wiki_data, library_data, user_input, chat_history=None, stream=False,
+                                   missing_sources=None):
+    """Phiên bản async của generate_final_response"""
+    prompt = build_final_prompt(book_info, wiki_data, library_data, user_input, chat_history, missing_sources)
+    try:
+        response = await runtime.get_gemini_model().generate_content_async(prompt, stream=stream)
+        if stream:
+            return async_runtime.stream_text(response, "Error when finding book infomation")
+        return response.text.strip()
+    except Exception as e:
+        return f"Error when finding book infomation: {str(e)}"
+
+def _remember(cache_key, answer):
+    """Lưu câu trả lời cuối cùng vào semantic cache (kể cả khi trả về dạng stream)"""
+    if hasattr(answer, "__aiter__"):
+        return semantic_cache.store_stream(cache_key, answer)
+    semantic_cache.store(cache_key, answer)
+    return answer
+
+@tracing.traced("book_info")
+async def aget_book_info(query, chat_history=None, stream=False):
+    """Xử lý truy vấn sách với ngữ cảnh hội thoại (async)"""
+    deadline = budget.Deadline()
+    # Câu hỏi gần giống đã được trả lời trước đó thì bỏ qua toàn bộ pipeline
+    with tracing.span("semantic_cache") as cache_span:
+        cache_key = await async_runtime.run_blocking(semantic_cache.prepare, query, chat_history)
+        cached_answer = semantic_cache.lookup(cache_key)
+        cache_span.set(hit=cached_answer is not None)
+    if cached_answer is not None:
+        print("[semantic_cache] hit")
+        return cached_answer
+
+    # Trong lúc chờ Gemini trích xuất, tra cứu trước các tên sách đoán được tại chỗ
+    speculation = prefetch.Speculation((search_wikipedia, search_open_library))
+    try:
+        return await _answer(query, chat_history, stream, deadline, cache_key, speculation)
+    finally:
+        speculation.discard()
+
+async def _answer(query, chat_history, stream, deadline, cache_key, speculation):
     # Trích xuất thông tin sách với ngữ cảnh
-    extracted_info = extract_book_info_gemini(query, chat_history)
+    extracted_info = await local_extractor.aextract_book_info(
+        query, chat_history, aextract_book_info_gemini, timeout=deadline.remaining(),
+        speculate=speculation.start,
+    )
     
     if "error" in extracted_info:
         return extracted_info["error"]
@@ -166,31 +246,46 @@ def get_book_info(query, chat_history=None):
     book_name = extracted_info.get("book_name")
     author_name = extracted_info.get("author_name")    
     if not book_name and author_name:
-        wiki_result = search_wikipedia(author_name)
-        if "error" in wiki_result:
+        ok, wiki_result = await budget.within(speculation.get(search_wikipedia, author_name), deadline)
+        if ok and "error" in wiki_result:
             return f"I couldn't find information about {author_name}. Would you like book recommendations instead?"
-        return generate_final_response(
+        missing = [] if ok else ["Wikipedia"]
+        answer = await agenerate_final_response(
             extracted_info,
             wiki_result,  # Author info from Wikipedia
             None,  # Không cần Open Library ở đây
             query,
-            chat_history
-        )  
-    # Tìm kiếm song song
-    with ThreadPoolExecutor() as executor:
-        future_wiki = executor.submit(search_wikipedia, book_name)
-        future_lib = executor.submit(search_open_library, book_name)
-        wiki_result = future_wiki.result()
-        lib_result = future_lib.result()
+            chat_history,
+            stream=stream,
+            missing_sources=missing,
+        )
+        return answer if missing else _remember(cache_key, answer)
+    # Tìm kiếm song song, nguồn nào trễ hạn thì trả lời với các nguồn còn lại
+    results, missing = await budget.gather_within({
+        "Wikipedia": speculation.get(search_wikipedia, book_name),
+        "Open Library": speculation.get(search_open_library, book_name),
+    }, deadline)
+    wiki_result = results.get("Wikipedia", {"error": "Wikipedia did not respond in time"})
+    lib_result = results.get("Open Library", {"error": "Open Library did not respond in time"})
+    # Câu hỏi tiếp theo thường là xin gợi ý sách tương tự: tải sẵn dữ liệu gợi ý ở nền
+    if "error" not in lib_result:
+        prefetch.warm_recommendations(book_name)
     
-    # Tạo phản hồi cuối cùng
-    return generate_final_response(
+    # Tạo phản hồi cuối cùng; câu trả lời thiếu nguồn không được lưu vào semantic cache
+    answer = await agenerate_final_response(
         extracted_info,
         wiki_result,
         lib_result,
         query,
-        chat_history
+        chat_history,
+        stream=stream,
+        missing_sources=missing,
     )
+    return answer if missing else _remember(cache_key, answer)
+
+def get_book_info(query, chat_history=None, session_id=None, stream=False):
+    """Wrapper đồng bộ của aget_book_info; async_runtime.cancel(session_id) hủy lượt đang chạy"""
+    return async_runtime.run_streamable(aget_book_info(query, chat_history, stream), session_id)
 
 # Ví dụ sử dụng
 if __name__ == "__main__":
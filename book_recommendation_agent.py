@@ -1,16 +1,21 @@
 import json
 import re
-import os
-import requests
-import google.generativeai as genai
+import async_runtime
+import book_vectors
+import budget
+import catalog
+from chat_context import format_chat_history
+import gemini_batcher
+import http_client
+import local_extractor
+import open_library
+import prefetch
 import random
-from dotenv import load_dotenv
+import runtime
+import singleflight
 import urllib.parse
-
-# Load API key
-load_dotenv()
-genai.configure(api_key=os.getenv("API_KEY"))
-model = genai.GenerativeModel("gemini-2.0-flash-lite")
+import tracing
+from response_cache import cached
 
 # Gemini example prompt
 examples = """
@@ -24,22 +29,11 @@ Example Input: "Can you suggest books by Agatha Christie?"
 Example Output: {"book_name": null, "author_name": "Agatha Christie", "genre": null}
 """
 
-def format_chat_history(chat_history):
-    """Chuyển đổi lịch sử chat từ Streamlit sang định dạng văn bản"""
-    if not chat_history:
-        return ""
-    
-    history_text = ""
-    for msg in chat_history[-6:]:  # Lấy 6 tin nhắn gần nhất (khoảng 3 lượt hội thoại)
-        role = "User" if msg["role"] == "user" else "Assistant"
-        history_text += f"{role}: {msg['content']}\n"
-    return history_text
-
-def extract_book_info_gemini(user_input: str, chat_history=None):
-    """Trích xuất thông tin sách bằng Gemini, có xem xét lịch sử trò chuyện"""
+def build_extraction_prompt(user_input: str, chat_history=None):
+    """Tạo prompt trích xuất thông tin sách, có xem xét lịch sử trò chuyện"""
     history_text = format_chat_history(chat_history) if chat_history else ""
     
-    prompt = f"""
+    return f"""
     You are an intelligent assistant that extracts book-related information from user queries.
     Consider this conversation history for context:
     {history_text}
@@ -53,82 +47,127 @@ def extract_book_info_gemini(user_input: str, chat_history=None):
     Current User Input: {user_input}
     Only return JSON:
     """
+
+def parse_extraction(text):
+    """Chỉ lấy phần JSON đầu tiên trong phản hồi của Gemini"""
+    match = re.search(r'\{.*\}', text.strip(), re.DOTALL)
+    if match:
+        return json.loads(match.group(0))
+    return {"error": "No valid JSON found"}
+
+@tracing.traced("extract.gemini")
+def extract_book_info_gemini(user_input: str, chat_history=None):
+    """Trích xuất thông tin sách bằng Gemini, có xem xét lịch sử trò chuyện"""
     try:
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        
-        # Chỉ lấy phần JSON đầu tiên nếu có
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
-        return {"error": "No valid JSON found"}
+        response = runtime.get_gemini_model().generate_content(build_extraction_prompt(user_input, chat_history))
+        return parse_extraction(response.text)
     except Exception as e:
         return {"error": f"Gemini error: {str(e)}"}
 
-def get_author_and_subject_from_book(book_name):
-    """Lấy author và subjects từ Open Library thông qua work ID."""
-    search_url = f"https://openlibrary.org/search.json?q={urllib.parse.quote(book_name)}"
+async def _aextract_one(user_input: str, chat_history=None):
+    """Phiên bản async của extract_book_info_gemini"""
     try:
-        response = requests.get(search_url, timeout=10)
-        if response.status_code != 200:
-            return None, []
+        response = await runtime.get_gemini_model().generate_content_async(build_extraction_prompt(user_input, chat_history))
+        return parse_extraction(response.text)
+    except Exception as e:
+        return {"error": f"Gemini error: {str(e)}"}
 
-        data = response.json()
-        if data.get("numFound", 0) == 0:
-            return None, []
+_extraction_batcher = gemini_batcher.ExtractionBatcher("book_recommendation", examples, _aextract_one)
 
-        book_data = data["docs"][0]
-        author = book_data.get("author_name", ["Unknown"])[0]
-        work_key = book_data.get("key")  # e.g., "/works/OL45883W"
+@tracing.traced("extract.gemini")
+async def aextract_book_info_gemini(user_input: str, chat_history=None):
+    """Trích xuất bằng Gemini (async); các yêu cầu đồng thời của nhiều session được gộp thành một lời gọi"""
+    return await _extraction_batcher.submit(user_input, chat_history)
 
-        if not work_key:
-            return author, []
+@cached("openlibrary_author_subjects")
+def _lookup_author_and_subjects(book_name):
+    """Gọi Open Library, trả về [author, subjects] hoặc None nếu không tìm thấy sách."""
+    book_data = open_library.search_first_work(book_name)
+    if book_data is None:
+        return None
 
-        work_id = work_key.split("/")[-1]
-        detail_url = f"https://openlibrary.org/works/{work_id}.json"
-        detail_response = requests.get(detail_url, timeout=10)
+    author = book_data.get("author_name", ["Unknown"])[0]
+    # search.json đã trả về subject nên thường không cần gọi thêm works/{id}.json
+    subjects = book_data.get("subject", [])
+    work_key = book_data.get("key")  # e.g., "/works/OL45883W"
+    if not subjects and work_key:
+        detail_data = open_library.get_work_details(work_key)
+        if detail_data:
+            subjects = detail_data.get("subjects", [])
+    return [author, subjects]
 
-        if detail_response.status_code != 200:
-            return author, []
 
-        detail_data = detail_response.json()
-        subjects = detail_data.get("subjects", [])
-        random_subjects = random.sample(subjects, min(3, len(subjects)))
-        print("author and subject retrieved",author, random_subjects)
-        return author, random_subjects
+@tracing.traced("fetch.seed_book")
+def get_author_and_subject_from_book(book_name):
+    """Lấy author và subjects từ Open Library thông qua work ID."""
+    work = catalog.find_work(book_name)
+    if work is not None:
+        result = [work["author_name"][0], work["subject"]]
+    else:
+        try:
+            result = _lookup_author_and_subjects(book_name)
+        except Exception as e:
+            print(f"[ERROR] OpenLibrary: {e}")
+            return None, []
 
-    except Exception as e:
-        print(f"[ERROR] OpenLibrary: {e}")
+    if result is None:
         return None, []
 
+    author, subjects = result
+    # Chọn ngẫu nhiên nhưng cố định theo tên sách để lượt tải sẵn (prefetch) và lượt gợi ý
+    # sau đó tra cứu cùng các chủ đề
+    random_subjects = random.Random(catalog.normalize(book_name)).sample(subjects, min(3, len(subjects)))
+    print("author and subject retrieved",author, random_subjects)
+    return author, random_subjects
+
 
+@cached("openlibrary_author")
+def _lookup_author_titles(author_name):
+    """Danh sách tiêu đề sách của tác giả (rỗng nếu không tìm thấy)."""
+    print("author search", author_name)
+    return open_library.search_titles_by_author(author_name)
+
+
+@tracing.traced("fetch.author")
 def search_books_by_author(author_name):
-    url = f"https://openlibrary.org/search.json?author={urllib.parse.quote(author_name.lower())}"
-    print("author url", url)
-    response = requests.get(url)
-    if response.status_code != 200:
-        return []
-    books = [
-        {"title": doc["title"], "author": author_name}
-        for doc in response.json().get("docs", [])
-    ]
+    # Ưu tiên catalog offline, chỉ gọi mạng khi catalog không có tác giả này
+    titles = catalog.titles_by_author(author_name)
+    if not titles:
+        try:
+            titles = _lookup_author_titles(author_name)
+        except Exception as e:
+            print(f"[ERROR] OpenLibrary: {e}")
+            return []
+    books = [{"title": title, "author": author_name} for title in titles]
     return random.sample(books, min(10, len(books)))
 
 
-def search_books_by_subject(subject):
-    """Tìm sách theo một chủ đề từ Open Library."""
+@cached("openlibrary_subject")
+def _lookup_subject_works(subject):
+    """Tối đa 30 sách của một chủ đề (rỗng nếu không tìm thấy)."""
     url = f"https://openlibrary.org/subjects/{urllib.parse.quote(subject.lower())}.json?details=false"
     print("subject url", url)
-    response = requests.get(url)
-
-    if response.status_code != 200:
-        return []  
+    response = http_client.get(url)
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
 
-    books = [
+    return [
         {"title": book["title"], "author": book.get("authors", [{"name": "Unknown"}])[0]["name"]}
         for book in response.json().get("works", [])[:30]
     ]
 
+
+@tracing.traced("fetch.subject")
+def search_books_by_subject(subject):
+    """Tìm sách theo một chủ đề từ Open Library."""
+    books = catalog.works_by_subject(subject)
+    if not books:
+        try:
+            books = _lookup_subject_works(subject)
+        except Exception as e:
+            print(f"[ERROR] OpenLibrary: {e}")
+            return []
     return random.sample(books, min(10, len(books)))  # Random tối đa 10 sách
 
 
@@ -145,8 +184,8 @@ def search_books_by_subject(subject):
 #         f.write(",\n")  # Dấu phẩy để phân biệt các bản ghi
 
 
-def generate_final_response(book_info, recommendations, user_input, chat_history=None):
-    prompt = f"""
+def build_final_prompt(book_info, recommendations, user_input, chat_history=None, missing_sources=None):
+    return f"""
     You are an expert in book recommendations.
 
     User input: "{user_input}"
@@ -159,39 +198,124 @@ def generate_final_response(book_info, recommendations, user_input, chat_history
 
     Recommended books:
     {json.dumps(recommendations, indent=2)}
-
+    {budget.missing_note(missing_sources)}
     Write a friendly, helpful, and natural-sounding response with recommendations.
     """
-    response = model.generate_content(prompt)
+
+@tracing.traced("generate")
+def generate_final_response(book_info, recommendations, user_input, chat_history=None, stream=False,
+                            missing_sources=None):
+    prompt = build_final_prompt(book_info, recommendations, user_input, chat_history, missing_sources)
+    response = runtime.get_gemini_model().generate_content(prompt, stream=stream)
+    if stream:
+        return async_runtime.iter_text(response, "Error generating recommendations")
     # log_gemini_response(prompt, response.text)
     return response.text.strip()
 
-def recommend_books(user_input, chat_history=None):
-    extracted_info = extract_book_info_gemini(user_input, chat_history)
+@tracing.traced("generate")
+async def agenerate_final_response(book_info, recommendations, user_input, chat_history=None, stream=False,
+                                   missing_sources=None):
+    prompt = build_final_prompt(book_info, recommendations, user_input, chat_history, missing_sources)
+    response = await runtime.get_gemini_model().generate_content_async(prompt, stream=stream)
+    if stream:
+        return async_runtime.stream_text(response, "Error generating recommendations")
+    return response.text.strip()
+
+async def _fan_out(jobs, deadline):
+    """Chạy song song các job (label, func, arg) tới hết hạn; job trễ hạn bị bỏ và trả về trong missing."""
+    with tracing.span("fan_out", jobs=len(jobs)):
+        done, missing = await budget.gather_within(
+            {label: singleflight.run_blocking(func, arg) for label, func, arg in jobs}, deadline
+        )
+
+    results = []
+    for label, result in done.items():
+        if isinstance(result, Exception):
+            print(f"[ERROR] {label}: {result}")
+            continue
+        results.extend(result)
+    return results, missing
+
+
+def _seed_jobs(author, subjects):
+    """Các tra cứu gợi ý theo tác giả và chủ đề của sách gốc."""
+    jobs = [("author", search_books_by_author, author)] if author else []
+    jobs += [(f"subject:{subject}", search_books_by_subject, subject) for subject in subjects]
+    return jobs
+
+
+@tracing.traced("book_recommendation")
+async def arecommend_books(user_input, chat_history=None, stream=False):
+    # Trong lúc chờ Gemini trích xuất, tra cứu trước sách gốc của các tên sách đoán được tại chỗ
+    speculation = prefetch.Speculation((get_author_and_subject_from_book,))
+    try:
+        return await _recommend(user_input, chat_history, stream, speculation)
+    finally:
+        speculation.discard()
+
+
+async def _recommend(user_input, chat_history, stream, speculation):
+    deadline = budget.Deadline()
+    extracted_info = await local_extractor.aextract_book_info(
+        user_input, chat_history, aextract_book_info_gemini, timeout=deadline.remaining(),
+        speculate=speculation.start,
+    )
     if "error" in extracted_info:
         return extracted_info["error"]
 
     book_name = extracted_info.get("book_name")
     author_name = extracted_info.get("author_name")
     genre = extracted_info.get("genre")
-    all_recommendations = []
-
-    if book_name:
-        author_from_book, subjects = get_author_and_subject_from_book(book_name)
-        if author_from_book:
-            author_books = search_books_by_author(author_from_book)
-            all_recommendations.extend(author_books)
-        if subjects:
-            for subject in subjects:
-                subject_books = search_books_by_subject(subject)
-                all_recommendations.extend(subject_books)
-
-    elif author_name:
-        all_recommendations.extend(search_books_by_author(author_name))
-    elif genre:
-        all_recommendations.extend(search_books_by_subject(genre))
-
-    return generate_final_response(extracted_info, all_recommendations, user_input, chat_history)
+
+    # Mọi tra cứu phải xong trước hạn của lượt chat, nguồn nào chậm sẽ bị bỏ
+    jobs = []
+    similar = []
+    missing = []
+    if book_name and book_vectors.available():
+        # Có index embedding của catalog thì gợi ý theo láng giềng gần nhất (không cần mạng)
+        ok, result = await budget.within(
+            async_runtime.run_blocking(book_vectors.similar_books, book_name), deadline
+        )
+        similar = result if ok else []
+    if book_name and not similar:
+        ok, seed = await budget.within(speculation.get(get_author_and_subject_from_book, book_name), deadline)
+        author_from_book, subjects = seed if ok else (None, [])
+        if not ok:
+            print("[WARN] seed_book missed the deadline, dropped")
+            missing.append("seed_book")
+        jobs += _seed_jobs(author_from_book, subjects)
+        prefetch.claim_warm(book_name, [(func, arg) for _, func, arg in jobs])
+
+    elif author_name and not book_name:
+        jobs.append(("author", search_books_by_author, author_name))
+    elif genre and not book_name:
+        jobs.append((f"subject:{genre}", search_books_by_subject, genre))
+
+    all_recommendations, fan_out_missing = await _fan_out(jobs, deadline)
+    all_recommendations = similar + all_recommendations
+    missing += fan_out_missing
+    if missing:
+        tracing.current_span().set(missing=missing)
+
+    return await agenerate_final_response(
+        extracted_info, all_recommendations, user_input, chat_history, stream=stream,
+        missing_sources=[f"Open Library ({label})" for label in missing],
+    )
+
+
+async def awarm_recommendations(book_name):
+    """Tải sẵn vào cache các tra cứu mà lượt gợi ý cho book_name sẽ cần (chạy nền qua prefetch)."""
+    if book_vectors.available():
+        return  # gợi ý theo embedding chạy tại chỗ, không cần tải trước
+    author, subjects = await singleflight.run_blocking(get_author_and_subject_from_book, book_name)
+    jobs = _seed_jobs(author, subjects)
+    prefetch.record_warm(book_name, [(func, arg) for _, func, arg in jobs])
+    await _fan_out(jobs, budget.Deadline())
+
+
+def recommend_books(user_input, chat_history=None, session_id=None, stream=False):
+    """Wrapper đồng bộ của arecommend_books; async_runtime.cancel(session_id) hủy lượt đang chạy"""
+    return async_runtime.run_streamable(arecommend_books(user_input, chat_history, stream), session_id)
 
 if __name__ == "__main__":
     test_queries = [
@@ -1,4 +1,370 @@
-def track_books(query,history):
-    return
-def view_books(query,history):
-    return
\ No newline at end of file
+import argparse
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import async_runtime
+import budget
+import local_extractor
+import tracing
+from book_info_agent import aextract_book_info_gemini
+
+# Danh sách đọc của từng người dùng, lưu trong SQLite (WAL) để nhiều session Streamlit
+# cùng đọc/ghi được. Mỗi process chỉ mở một kết nối; các lệnh ghi được gom lại và
+# commit chung một transaction bởi một thread ghi duy nhất nên không tranh chấp khóa.
+TRACKER_PATH = os.getenv("TRACKER_PATH", os.path.join("data", "book_tracker.sqlite3"))
+WRITE_BATCH_SIZE = 256
+# Thời gian tối đa (giây) một lệnh ghi chờ thread ghi trước khi báo lỗi
+WRITE_TIMEOUT = float(os.getenv("TRACKER_WRITE_TIMEOUT", "30"))
+PAGE_SIZE = 20
+STATUSES = ("to_read", "reading", "read")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reading_list (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    title_norm TEXT NOT NULL,
+    author TEXT,
+    status TEXT NOT NULL DEFAULT 'to_read',
+    added_at REAL NOT NULL,
+    finished_at REAL,
+    UNIQUE (user_id, title_norm)
+);
+CREATE INDEX IF NOT EXISTS idx_reading_list_user ON reading_list(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_reading_list_user_status ON reading_list(user_id, status, id);
+"""
+
+UPSERT_SQL = """
+INSERT INTO reading_list (user_id, title, title_norm, author, status, added_at, finished_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, title_norm) DO UPDATE SET
+    status = excluded.status,
+    author = COALESCE(excluded.author, reading_list.author),
+    finished_at = excluded.finished_at
+"""
+DELETE_SQL = "DELETE FROM reading_list WHERE user_id = ? AND title_norm = ?"
+
+_conn = None
+_conn_path = None
+_lock = threading.Lock()        # tuần tự hóa việc dùng chung kết nối
+_writes = queue.Queue()
+_writer = None
+
+
+def _normalize_title(title):
+    words = re.findall(r"\w+", title.lower().replace("'", "").replace("’", ""))
+    if len(words) > 1 and words[0] in ("the", "a", "an"):
+        words = words[1:]
+    return " ".join(words)
+
+
+def init_book_db(path=TRACKER_PATH):
+    """Mở (hoặc tạo) database của tracker; gọi lại với path khác sẽ chuyển sang database đó."""
+    global _conn, _conn_path
+    with _lock:
+        if _conn is not None and _conn_path == path:
+            return _conn
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        if _conn is not None:
+            _conn.close()
+        _conn, _conn_path = conn, path
+        return _conn
+
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def _get_conn():
+    return _conn if _conn is not None else init_book_db()
+
+
+def _commit(conn, batch):
+    """Chạy batch trong một transaction; lỗi thì rollback (nếu kết nối còn dùng được) rồi raise."""
+    with _lock:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            results = [conn.executemany(sql, rows).rowcount for sql, rows, _ in batch]
+            conn.execute("COMMIT")
+            return results
+        except Exception:
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass        # kết nối đã bị close() giữa chừng
+            raise
+
+
+def _write_loop():
+    while True:
+        batch = [_writes.get()]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_writes.get_nowait())
+            except queue.Empty:
+                break
+        # Bỏ các lệnh mà người gọi đã hủy vì chờ quá WRITE_TIMEOUT
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            continue
+        try:
+            results = _commit(_get_conn(), batch)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                continue
+            # Ghi lại từng lệnh một để một dòng lỗi không làm hỏng lệnh ghi của người khác
+            for item in batch:
+                try:
+                    item[2].set_result(_commit(_get_conn(), [item])[0])
+                except Exception as e:
+                    item[2].set_exception(e)
+            continue
+        for (_, _, future), rowcount in zip(batch, results):
+            future.set_result(rowcount)
+
+
+def _submit_write(sql, rows):
+    """Đưa lệnh ghi vào hàng đợi; thread ghi commit nhiều lệnh trong cùng một transaction."""
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _lock:
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_write_loop, name="book-tracker-writer", daemon=True)
+                _writer.start()
+    future = Future()
+    _writes.put((sql, rows, future))
+    try:
+        return future.result(timeout=WRITE_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"book tracker write did not finish within {WRITE_TIMEOUT}s")
+
+
+def add_books(user_id, books, status="to_read"):
+    """Thêm (hoặc cập nhật trạng thái) nhiều sách [{"title", "author"}] trong một lần ghi."""
+    if status not in STATUSES:
+        raise ValueError(f"unknown status {status!r}, expected one of {STATUSES}")
+    now = time.time()
+    rows = [
+        (user_id, book["title"], _normalize_title(book["title"]), book.get("author"),
+         status, now, now if status == "read" else None)
+        for book in books if _normalize_title(book["title"])
+    ]
+    return _submit_write(UPSERT_SQL, rows) if rows else 0
+
+
+def add_book(user_id, title, author=None, status="to_read"):
+    return add_books(user_id, [{"title": title, "author": author}], status)
+
+
+def remove_book(user_id, title):
+    """Xóa sách khỏi danh sách; trả về số dòng bị xóa (0 nếu không có)."""
+    return _submit_write(DELETE_SQL, [(user_id, _normalize_title(title))])
+
+
+def list_books(user_id, status=None, page_size=PAGE_SIZE, after=None):
+    """Một trang sách của người dùng, mới thêm trước; trả về (books, cursor của trang sau hoặc None).
+
+    Phân trang theo id (keyset) nên trang sau không phải quét lại các trang trước.
+    """
+    sql = "SELECT id, title, author, status, added_at, finished_at FROM reading_list WHERE user_id = ?"
+    params = [user_id]
+    if status:
+        sql += " AND status = ?"
+        params.append(status)
+    if after is not None:
+        sql += " AND id < ?"
+        params.append(after)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(page_size + 1)
+
+    conn = _get_conn()
+    with _lock:
+        rows = conn.execute(sql, params).fetchall()
+    books = [
+        {
+            "title": title,
+            "author": author,
+            "status": book_status,
+            "added": time.strftime("%Y-%m-%d", time.localtime(added_at)),
+            "finished": time.strftime("%Y-%m-%d", time.localtime(finished_at)) if finished_at else None,
+        }
+        for _, title, author, book_status, added_at, finished_at in rows[:page_size]
+    ]
+    cursor = rows[page_size - 1][0] if len(rows) > page_size else None
+    return books, cursor
+
+
+# ---------------------------------------------------------------------------
+# Chat
+
+
+# (mẫu câu, hành động) theo thứ tự ưu tiên; nhóm "title" là tên sách khi gazetteer không nhận ra
+INTENT_PATTERNS = [
+    (r"\b(?:remove|delete)\s+(?P<title>.+?)(?:\s+from\b.*)?$", "remove"),
+    (r"\bmark\s+(?P<title>.+?)\s+as\s+(?:read|finished|done)\b", "read"),
+    (r"\b(?:finished|completed|done with|have read|i read)\s+(?P<title>.+)$", "read"),
+    (r"\b(?:started|starting|i'?m reading|currently reading)\s+(?P<title>.+)$", "reading"),
+    (r"\badd\s+(?P<title>.+?)(?:\s+to\b.*)?$", "to_read"),
+    (r"\b(?:show|list|view|what|which|track)\b", "view"),
+]
+# Phần bắt được không phải tên sách: đại từ ("it", "that one"), lượng từ ("everything") hay "to my reading list"
+VAGUE_TITLE = re.compile(
+    r"^(?:(?:it|this|that|these|those|them|one|all|both|every|everything|anything|something|nothing|some|any)"
+    r"(?:\s+(?:one|ones|book|books|novel|of them|of it))?"
+    r"|(?:the|a|an|my|this|that)\s+(?:book|books|novel|one)"
+    r"|(?:to|from|on|in|into)\s+(?:my|the)\b.*"
+    r"|my\s+.*\blist)$",
+    re.IGNORECASE,
+)
+# Gemini trích xuất phải xong trong thời gian này, nếu không thì hỏi lại người dùng
+EXTRACTION_TIMEOUT = budget.TURN_BUDGET - budget.GENERATION_RESERVE
+
+
+def _parse(text):
+    """Trả về (hành động, tên sách hoặc None) từ câu của người dùng, chỉ dựa vào mẫu câu."""
+    for pattern, action in INTENT_PATTERNS:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if not match:
+            continue
+        if action == "view":
+            return action, None
+        quoted = re.search(r"[\"'“](.+?)[\"'”](?:\s|$)", text)
+        title = quoted.group(1) if quoted else match.group("title").strip(" \"'")
+        return action, None if VAGUE_TITLE.match(title) else title
+    return "view", None
+
+
+async def _resolve_book(text, title, history):
+    """Tên sách và tác giả: gazetteer, rồi phần bắt được từ mẫu câu, cuối cùng Gemini (có lịch sử chat)."""
+    info, _ = local_extractor.extract(text, history)
+    if info["book_name"] or (title and not (history and local_extractor.refers_to_history(text))):
+        return info["book_name"] or title, info["author_name"]
+    # "Mark it as finished": Gemini đọc lịch sử hội thoại để biết "it" là sách nào
+    info = await local_extractor.aextract_book_info(text, history, aextract_book_info_gemini,
+                                                    timeout=EXTRACTION_TIMEOUT)
+    if info.get("book_name"):
+        return info["book_name"], info.get("author_name")
+    return title, info.get("author_name")
+
+
+def _render(books, heading):
+    if not books:
+        return "Your reading list is empty. Try \"Add Dune to my reading list\"."
+    lines = [heading, "", "| Title | Author | Status | Added | Finished |", "|---|---|---|---|---|"]
+    for book in books:
+        lines.append(
+            f"| {book['title']} | {book['author'] or ''} | {book['status'].replace('_', ' ')} "
+            f"| {book['added']} | {book['finished'] or ''} |"
+        )
+    return "\n".join(lines)
+
+
+def _apply(user_id, action, title, author):
+    if action == "remove":
+        if remove_book(user_id, title):
+            return f"Removed **{title}** from your reading list."
+        return f"**{title}** is not in your reading list."
+    add_book(user_id, title, author, status=action)
+    return {
+        "to_read": f"Added **{title}** to your reading list.",
+        "reading": f"Marked **{title}** as currently reading.",
+        "read": f"Marked **{title}** as read. Nice work!",
+    }[action]
+
+
+@tracing.traced("book_tracker")
+async def atrack_books(query, history=None, user_id="default"):
+    """Xử lý câu lệnh tracker (thêm/đánh dấu đã đọc/xóa/xem) và trả về câu trả lời dạng markdown."""
+    text = query.strip().rstrip(".!?").replace("’", "'")
+    action, title = _parse(text)
+    if action == "view":
+        status = "read" if re.search(r"\b(read|finished)\b", query, re.IGNORECASE) else None
+        return await async_runtime.run_blocking(view_books, user_id, status)
+    title, author = await _resolve_book(text, title, history)
+    if not title:
+        # Không đoán bừa: ghi một dòng sai còn tệ hơn hỏi lại
+        return "Which book do you mean? Please include its title, e.g. \"Add Dune to my reading list\"."
+    return await async_runtime.run_blocking(_apply, user_id, action, title, author)
+
+
+def track_books(query, history=None, user_id="default", session_id=None):
+    """Wrapper đồng bộ của atrack_books."""
+    return async_runtime.run(atrack_books(query, history, user_id), session_id)
+
+
+def view_books(user_id="default", status=None, page_size=PAGE_SIZE, after=None):
+    """Một trang danh sách đọc dạng bảng markdown."""
+    books, cursor = list_books(user_id, status, page_size, after)
+    heading = "Books you've read:" if status == "read" else "Your reading list:"
+    text = _render(books, heading)
+    if cursor is not None:
+        text += f"\n\n_Showing the {page_size} most recent books._"
+    return text
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def benchmark(threads=16, users=64, ops=4000, path=None):
+    """Đo throughput khi nhiều thread cùng thêm sách và đọc danh sách (tỉ lệ 1 ghi : 1 đọc)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        init_book_db(path or os.path.join(tmp, "bench.sqlite3"))
+        latencies = {"add": [], "list": []}
+
+        def one(i):
+            user_id = f"user-{i % users}"
+            start = time.perf_counter()
+            if i % 2:
+                list_books(user_id)
+                kind = "list"
+            else:
+                add_book(user_id, f"Benchmark Book {i}", "Bench Author")
+                kind = "add"
+            return kind, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for kind, seconds in pool.map(one, range(ops)):
+                latencies[kind].append(seconds)
+        elapsed = time.perf_counter() - start
+
+        print(f"{ops} ops on {threads} threads in {elapsed:.2f}s ({ops / elapsed:.0f} ops/s)")
+        for kind, values in latencies.items():
+            print(f"  {kind:4}: {len(values) / elapsed:7.0f}/s  p50={_percentile(values, 50) * 1000:.2f}ms  "
+                  f"p95={_percentile(values, 95) * 1000:.2f}ms  p99={_percentile(values, 99) * 1000:.2f}ms")
+        close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent reading-list writes and reads.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--ops", type=int, default=4000)
+    args = parser.parse_args()
+    benchmark(args.threads, args.users, args.ops)
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import catalog
+import runtime
+import tracing
+
+# Gợi ý sách "giống X" bằng tìm kiếm láng giềng gần nhất trên embedding của catalog.
+# Ma trận embedding (float32, đã chuẩn hóa) được build sẵn và memory-map khi chạy: truy vấn là
+# một phép nhân ma trận-vector trực tiếp trên trang file (page cache dùng chung giữa các replica,
+# không copy vào RAM của process), không cần mạng và luôn cho cùng một kết quả.
+VECTORS_DIR = os.getenv("BOOK_VECTORS_DIR", os.path.join("data", "book_vectors"))
+ENCODE_BATCH_SIZE = 256
+# Sách gần nhất có điểm cosine thấp hơn ngưỡng này thì coi như catalog không có sách giống
+SIMILAR_MIN_SCORE = float(os.getenv("SIMILAR_MIN_SCORE", "0.5"))
+DESCRIPTION_CHARS = 300
+
+_index = None
+_lock = threading.Lock()
+
+
+def _book_text(work):
+    text = f"{work['title']} by {', '.join(work['author_name'])}."
+    if work.get("description"):
+        text += " " + work["description"][:DESCRIPTION_CHARS]
+    return text
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def build(path=VECTORS_DIR, encoder=None):
+    """Encode toàn bộ catalog vào path/embeddings.npy (float32) kèm rowids.npy và meta.json."""
+    encoder = encoder or runtime.get_encoder()
+    total = int(catalog.fingerprint().split(":")[0])
+    os.makedirs(path, exist_ok=True)
+
+    matrix = None
+    rowids = np.zeros(total, dtype=np.int64)
+    batch, start, written = [], time.perf_counter(), 0
+
+    def flush():
+        nonlocal matrix, written
+        embeddings = _normalize(np.asarray(encoder([_book_text(work) for work in batch]), dtype=np.float32))
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                os.path.join(path, "embeddings.npy.tmp"), mode="w+", dtype=np.float32,
+                shape=(total, embeddings.shape[1]),
+            )
+        matrix[written:written + len(batch)] = embeddings
+        rowids[written:written + len(batch)] = [work["rowid"] for work in batch]
+        written += len(batch)
+        batch.clear()
+
+    for work in catalog.iter_works():
+        batch.append(work)
+        if len(batch) >= ENCODE_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    if matrix is None:
+        raise ValueError("catalog is empty, import it first with catalog.py")
+    matrix.flush()
+    dim = int(matrix.shape[1])
+    del matrix
+
+    np.save(os.path.join(path, "rowids.npy"), rowids[:written])
+    os.replace(os.path.join(path, "embeddings.npy.tmp"), os.path.join(path, "embeddings.npy"))
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"catalog": catalog.fingerprint(), "encoder_name": encoder.name, "encoder_type": encoder.type,
+                   "dim": dim, "count": written}, f, indent=2)
+    print(f"[book_vectors] encoded {written} works in {time.perf_counter() - start:.1f}s -> {path}")
+
+
+def _load(path=VECTORS_DIR):
+    """Memory-map index; None nếu chưa build, catalog đã thay đổi hoặc index build bằng encoder khác."""
+    global _index
+    if _index is not None:
+        return _index
+    with _lock:
+        if _index is None:
+            meta_path = os.path.join(path, "meta.json")
+            if not os.path.exists(meta_path):
+                return None
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["catalog"] != catalog.fingerprint():
+                print("[book_vectors] index is stale, rebuild it with book_vectors.py")
+                return None
+            matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+            # Đổi ROUTE_ENCODER thì vector của query và của index nằm trong hai không gian khác nhau
+            encoder = runtime.get_encoder()
+            dim = len(encoder(["dimension probe"])[0])
+            if matrix.dtype != np.float32:
+                print("[book_vectors] index uses an old format, rebuild it with book_vectors.py")
+                return None
+            if (meta.get("encoder_name"), meta.get("encoder_type")) != (encoder.name, encoder.type) \
+                    or matrix.shape[1] != dim:
+                print(f"[book_vectors] index was built with {meta.get('encoder_name')} "
+                      f"({meta.get('encoder_type')}, dim {matrix.shape[1]}), not {encoder.name} "
+                      f"({encoder.type}, dim {dim}); rebuild it with book_vectors.py")
+                return None
+            _index = (matrix, np.load(os.path.join(path, "rowids.npy")))
+    return _index
+
+
+def available():
+    return catalog.available() and _load() is not None
+
+
+def _top_k(matrix, query, k, exclude):
+    """Top-k theo cosine trên ma trận float32 đã memory-map (BLAS đọc thẳng từ file, không copy)."""
+    scores = matrix @ query.astype(np.float32)
+    scores[exclude] = -np.inf
+    take = min(k, len(scores))
+    rows = np.argpartition(-scores, take - 1)[:take]
+    # Sắp theo điểm giảm dần, hòa điểm thì theo thứ tự trong catalog (kết quả ổn định)
+    order = np.lexsort((rows, -scores[rows]))
+    return rows[order], scores[rows[order]]
+
+
+@tracing.traced("similar_books")
+def similar_books(book_name, k=10):
+    """Top-k sách giống book_name nhất trong catalog: [{"title", "author", "score"}].
+
+    Trả về [] nếu catalog/index chưa sẵn sàng, sách gốc không có trong catalog hoặc không có sách
+    nào đủ giống (SIMILAR_MIN_SCORE) để agent quay về cách tra cứu theo tác giả/chủ đề.
+    """
+    index = _load()
+    if index is None:
+        return []
+    matrix, rowids = index
+
+    seed = catalog.find_work(book_name)
+    if seed is None:
+        return []
+    exclude = []
+    position = int(np.searchsorted(rowids, seed["rowid"]))
+    if position < len(rowids) and rowids[position] == seed["rowid"]:
+        query = np.asarray(matrix[position], dtype=np.float32)
+        exclude = [position]
+    else:
+        query = _normalize(np.asarray(runtime.get_encoder()([_book_text(seed)])[0], dtype=np.float32))
+
+    # Lấy dư để còn đủ k sau khi bỏ các bản trùng tên với sách gốc
+    positions, scores = _top_k(matrix, query, k * 2, exclude)
+    if len(scores) == 0 or scores[0] < SIMILAR_MIN_SCORE:
+        return []
+    works = catalog.works_by_rowids(rowids[positions])
+    seed_title = catalog.normalize(seed["title"])
+    results, seen = [], {seed_title}
+    for work, score in zip(works, scores):
+        title = catalog.normalize(work["title"])
+        if title in seen:
+            continue
+        seen.add(title)
+        results.append({"title": work["title"], "author": work["author_name"][0], "score": round(float(score), 4)})
+        if len(results) == k:
+            break
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the catalog embedding index.")
+    parser.add_argument("--path", default=VECTORS_DIR)
+    parser.add_argument("--query", help="print books similar to this title instead of building")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.query:
+        start = time.perf_counter()
+        for book in similar_books(args.query, args.k):
+            print(f"{book['score']:.3f}  {book['title']} ({book['author']})")
+        print(f"[{(time.perf_counter() - start) * 1000:.1f}ms]")
+    else:
+        build(args.path)
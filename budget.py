@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+import os
+import time
+
+# Ngân sách thời gian cho mỗi lượt chat: các bước trích xuất/tra cứu phải xong trước
+# TURN_BUDGET - GENERATION_RESERVE giây kể từ đầu lượt, phần còn lại để Gemini sinh câu trả lời.
+# Nguồn nào trễ hạn sẽ bị bỏ qua và câu trả lời được tạo từ các nguồn đã có.
+TURN_BUDGET = float(os.getenv("TURN_BUDGET", "8"))
+GENERATION_RESERVE = float(os.getenv("GENERATION_RESERVE", "2"))
+
+MISSING_SOURCES_NOTE = """
+        These sources did not respond in time and are missing: {sources}.
+        Answer with the information that is available and briefly mention that it may be incomplete.
+"""
+
+
+# Hạn của lượt chat đang chạy; được chép sang thread của executor (async_runtime.run_blocking)
+# để http_client không timeout/retry lâu hơn phần ngân sách còn lại
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class Deadline:
+    def __init__(self, budget=TURN_BUDGET, reserve=GENERATION_RESERVE):
+        self.start = time.perf_counter()
+        self.lookup_end = self.start + max(budget - reserve, 0.0)
+        _current.set(self)
+
+    def remaining(self):
+        """Số giây còn lại cho phần tra cứu (0 nếu đã hết hạn)."""
+        return max(self.lookup_end - time.perf_counter(), 0.0)
+
+
+def current():
+    """Deadline của lượt chat hiện tại (None nếu không chạy trong lượt chat nào)."""
+    return _current.get()
+
+
+async def within(awaitable, deadline):
+    """Chờ awaitable trong thời gian còn lại; trả về (True, kết quả) hoặc (False, None) nếu trễ hạn."""
+    try:
+        return True, await asyncio.wait_for(awaitable, timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        return False, None
+
+
+async def gather_within(jobs, deadline):
+    """Chạy song song các job {label: awaitable} tới hết hạn.
+
+    Trả về ({label: kết quả hoặc Exception} của các job đã xong, [label của các job trễ hạn]).
+    """
+    tasks = {label: asyncio.ensure_future(awaitable) for label, awaitable in jobs.items()}
+    if tasks:
+        await asyncio.wait(tasks.values(), timeout=deadline.remaining())
+
+    done, missing = {}, []
+    for label, task in tasks.items():
+        if not task.done():
+            task.cancel()
+            print(f"[WARN] {label} missed the deadline, dropped")
+            missing.append(label)
+        elif task.exception() is not None:
+            done[label] = task.exception()
+        else:
+            done[label] = task.result()
+    return done, missing
+
+
+def missing_note(missing):
+    """Đoạn prompt báo cho Gemini biết nguồn nào bị thiếu (rỗng nếu đủ nguồn)."""
+    return MISSING_SOURCES_NOTE.format(sources=", ".join(missing)) if missing else ""
@@ -0,0 +1,315 @@
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+
+# Catalog sách offline: nạp từ dump của Open Library (hoặc fixture nhỏ khi test) vào SQLite,
+# có index full-text cho title/author và index ngược theo subject.
+# Các agent tra catalog trước, chỉ gọi mạng khi catalog không có kết quả.
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join("data", "catalog.sqlite3"))
+BATCH_SIZE = 10000
+ARTICLES = {"the", "a", "an"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    key TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    title_norm TEXT NOT NULL,
+    author TEXT,
+    authors TEXT NOT NULL DEFAULT '[]',
+    first_publish_year INTEGER,
+    description TEXT,
+    subjects TEXT NOT NULL DEFAULT '[]'
+);
+CREATE INDEX IF NOT EXISTS idx_works_title_norm ON works(title_norm);
+CREATE TABLE IF NOT EXISTS work_authors (
+    author_norm TEXT NOT NULL,
+    work_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_work_authors ON work_authors(author_norm);
+CREATE INDEX IF NOT EXISTS idx_work_authors_work ON work_authors(work_key);
+CREATE TABLE IF NOT EXISTS work_subjects (
+    subject_norm TEXT NOT NULL,
+    work_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_work_subjects ON work_subjects(subject_norm);
+CREATE INDEX IF NOT EXISTS idx_work_subjects_work ON work_subjects(work_key);
+CREATE VIRTUAL TABLE IF NOT EXISTS works_fts USING fts5(
+    title, author, content='works', content_rowid='rowid'
+);
+"""
+
+WORK_COLUMNS = "rowid, key, title, authors, first_publish_year, description, subjects"
+
+_conn = None
+_lock = threading.Lock()
+
+
+def normalize(text):
+    """Chữ thường, bỏ dấu câu và mạo từ đầu câu; dùng cho so khớp title/author/subject."""
+    words = re.findall(r"\w+", str(text).lower().replace("'", "").replace("_", " "))
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return " ".join(words)
+
+
+def _connect(path=CATALOG_PATH):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _get_conn():
+    """Kết nối dùng chung (chỉ đọc) tới catalog; None nếu chưa import catalog."""
+    global _conn
+    if _conn is None:
+        if not os.path.exists(CATALOG_PATH):
+            return None
+        with _lock:
+            if _conn is None:
+                _conn = _connect(CATALOG_PATH)
+    return _conn
+
+
+def available():
+    return _get_conn() is not None
+
+
+def _query(sql, params=()):
+    conn = _get_conn()
+    if conn is None:
+        return []
+    with _lock:
+        return conn.execute(sql, params).fetchall()
+
+
+def _work_doc(row):
+    rowid, key, title, authors, year, description, subjects = row
+    return {
+        "rowid": rowid,
+        "key": key,
+        "title": title,
+        "author_name": json.loads(authors) or ["Unknown"],
+        "first_publish_year": year,
+        "description": description,
+        "subject": json.loads(subjects),
+    }
+
+
+def find_work(title):
+    """Tìm sách theo tên; trả về doc giống search.json (kèm description) hoặc None.
+
+    Chỉ nhận kết quả có title trùng khớp (sau chuẩn hóa) hoặc là title chính của
+    một tên có phụ đề, để không trả nhầm sách khác khi catalog không có sách cần tìm.
+    """
+    wanted = normalize(title)
+    if not wanted:
+        return None
+    rows = _query(f"SELECT {WORK_COLUMNS} FROM works WHERE title_norm = ? LIMIT 1", (wanted,))
+    if not rows:
+        terms = " ".join(f'"{word}"' for word in wanted.split())
+        candidates = _query(
+            f"SELECT {WORK_COLUMNS} FROM works WHERE rowid IN "
+            "(SELECT rowid FROM works_fts WHERE works_fts MATCH ? ORDER BY rank LIMIT 20)",
+            (f"title : ({terms})",),
+        )
+        rows = [row for row in candidates if normalize(row[2].split(":")[0]) == wanted][:1]
+    return _work_doc(rows[0]) if rows else None
+
+
+def works_by_rowids(rowids):
+    """Lấy các work theo rowid, giữ nguyên thứ tự của rowids."""
+    rowids = [int(rowid) for rowid in rowids]
+    if not rowids:
+        return []
+    placeholders = ",".join("?" * len(rowids))
+    rows = _query(f"SELECT {WORK_COLUMNS} FROM works WHERE rowid IN ({placeholders})", rowids)
+    by_rowid = {row[0]: _work_doc(row) for row in rows}
+    return [by_rowid[rowid] for rowid in rowids if rowid in by_rowid]
+
+
+def iter_works(batch_size=BATCH_SIZE):
+    """Duyệt toàn bộ catalog theo thứ tự rowid (dùng khi build index embedding)."""
+    last = 0
+    while True:
+        rows = _query(
+            f"SELECT {WORK_COLUMNS} FROM works WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch_size)
+        )
+        if not rows:
+            return
+        for row in rows:
+            yield _work_doc(row)
+        last = rows[-1][0]
+
+
+def fingerprint():
+    """Số lượng và rowid lớn nhất của catalog, dùng để biết index phụ thuộc đã lỗi thời chưa."""
+    rows = _query("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM works")
+    return f"{rows[0][0]}:{rows[0][1]}" if rows else None
+
+
+def titles_by_author(author_name):
+    """Danh sách tiêu đề sách của một tác giả trong catalog."""
+    rows = _query(
+        "SELECT w.title FROM work_authors a JOIN works w ON w.key = a.work_key "
+        "WHERE a.author_norm = ? ORDER BY w.title",
+        (normalize(author_name),),
+    )
+    return [row[0] for row in rows]
+
+
+def works_by_subject(subject, limit=30):
+    """Tối đa `limit` sách thuộc một subject, dạng {"title", "author"}."""
+    rows = _query(
+        "SELECT w.title, w.author FROM work_subjects s JOIN works w ON w.key = s.work_key "
+        "WHERE s.subject_norm = ? ORDER BY w.first_publish_year IS NULL, w.first_publish_year, w.title LIMIT ?",
+        (normalize(subject), limit),
+    )
+    return [{"title": title, "author": author or "Unknown"} for title, author in rows]
+
+
+# ---------------------------------------------------------------------------
+# Import
+
+
+def _description(value):
+    if isinstance(value, dict):
+        return value.get("value")
+    return value
+
+
+def _publish_year(record):
+    if isinstance(record.get("first_publish_year"), int):
+        return record["first_publish_year"]
+    match = re.search(r"\d{4}", str(record.get("first_publish_date", "")))
+    return int(match.group(0)) if match else None
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _read_dump(path):
+    """Đọc file dump Open Library (type\\tkey\\trevision\\tlast_modified\\tjson)."""
+    with _open(path) as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 5:
+                yield json.loads(parts[4])
+
+
+def _load_author_names(conn, path):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS author_names (key TEXT PRIMARY KEY, name TEXT)")
+    batch = []
+    for record in _read_dump(path):
+        if record.get("name"):
+            batch.append((record["key"], record["name"]))
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany("INSERT OR REPLACE INTO author_names VALUES (?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT OR REPLACE INTO author_names VALUES (?, ?)", batch)
+
+
+def _dump_works(conn, path):
+    """Chuyển record works của dump sang dạng fixture (tên tác giả lấy từ author_names)."""
+    for record in _read_dump(path):
+        if not record.get("title"):
+            continue
+        names = []
+        for entry in record.get("authors", []):
+            author_key = (entry.get("author") or {}).get("key") if isinstance(entry, dict) else None
+            if author_key:
+                row = conn.execute("SELECT name FROM author_names WHERE key = ?", (author_key,)).fetchone()
+                if row:
+                    names.append(row[0])
+        yield {
+            "key": record["key"],
+            "title": record["title"],
+            "authors": names,
+            "first_publish_year": _publish_year(record),
+            "description": _description(record.get("description")),
+            "subjects": record.get("subjects", []),
+        }
+
+
+def _read_fixture(path):
+    with _open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def import_records(records, path=CATALOG_PATH):
+    """Ghi các record {key, title, authors, first_publish_year, description, subjects} vào catalog."""
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    conn = _connect(path)
+    count = 0
+    works, authors, subjects = [], [], []
+
+    def flush():
+        # Import lại cùng một work thì thay thế index author/subject cũ
+        keys = [(work[0],) for work in works]
+        conn.executemany("DELETE FROM work_authors WHERE work_key = ?", keys)
+        conn.executemany("DELETE FROM work_subjects WHERE work_key = ?", keys)
+        conn.executemany("INSERT OR REPLACE INTO works VALUES (?, ?, ?, ?, ?, ?, ?, ?)", works)
+        conn.executemany("INSERT INTO work_authors VALUES (?, ?)", authors)
+        conn.executemany("INSERT INTO work_subjects VALUES (?, ?)", subjects)
+        works.clear()
+        authors.clear()
+        subjects.clear()
+
+    with conn:
+        for record in records:
+            names = record.get("authors") or ([record["author"]] if record.get("author") else [])
+            works.append((
+                record["key"],
+                record["title"],
+                normalize(record["title"]),
+                names[0] if names else None,
+                json.dumps(names, ensure_ascii=False),
+                record.get("first_publish_year"),
+                record.get("description"),
+                json.dumps(record.get("subjects", []), ensure_ascii=False),
+            ))
+            authors.extend((normalize(name), record["key"]) for name in names)
+            subjects.extend((normalize(subject), record["key"]) for subject in set(record.get("subjects", [])))
+            count += 1
+            if len(works) >= BATCH_SIZE:
+                flush()
+        flush()
+        conn.execute("INSERT INTO works_fts(works_fts) VALUES ('rebuild')")
+    conn.close()
+    return count
+
+
+def import_dump(works_path, authors_path=None, path=CATALOG_PATH):
+    """Import dump works (và authors để có tên tác giả) của Open Library."""
+    conn = sqlite3.connect(":memory:")
+    if authors_path:
+        _load_author_names(conn, authors_path)
+    else:
+        conn.execute("CREATE TEMP TABLE author_names (key TEXT PRIMARY KEY, name TEXT)")
+    return import_records(_dump_works(conn, works_path), path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline book catalog.")
+    parser.add_argument("--works", help="Open Library works dump (.txt or .txt.gz)")
+    parser.add_argument("--authors", help="Open Library authors dump, used to resolve author names")
+    parser.add_argument("--fixture", help="JSONL file of catalog records")
+    parser.add_argument("--path", default=CATALOG_PATH)
+    args = parser.parse_args()
+
+    if args.fixture:
+        print(f"imported {import_records(_read_fixture(args.fixture), args.path)} works from {args.fixture}")
+    if args.works:
+        print(f"imported {import_dump(args.works, args.authors, args.path)} works from {args.works}")
+    if not args.fixture and not args.works:
+        parser.error("nothing to import: pass --works and/or --fixture")
@@ -0,0 +1,193 @@
+import os
+import sys
+import threading
+from collections import deque
+
+import runtime
+
+# Ngữ cảnh hội thoại dùng chung cho mọi agent: một cửa sổ trượt giới hạn theo số token,
+# được cập nhật dần khi có tin nhắn mới thay vì dựng lại chuỗi mỗi lần gọi Gemini.
+# Các lượt cũ bị đẩy ra khỏi cửa sổ có thể được tóm tắt (CHAT_HISTORY_SUMMARY=1).
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKENS", "600"))
+MESSAGE_TOKEN_LIMIT = int(os.getenv("CHAT_MESSAGE_TOKENS", "200"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKENS", "150"))
+SUMMARIZE_OLD_TURNS = os.getenv("CHAT_HISTORY_SUMMARY", "0") == "1"
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """Ước lượng số token (~4 ký tự/token), đủ để giới hạn kích thước prompt mà không cần tokenizer."""
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def _truncate(text, max_tokens):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+
+def _format_message(msg):
+    role = "User" if msg["role"] == "user" else "Assistant"
+    content = " ".join(str(msg["content"]).split())
+    return f"{role}: {_truncate(content, MESSAGE_TOKEN_LIMIT)}\n"
+
+
+def gemini_summarizer(summary, lines):
+    """Gộp tóm tắt cũ và các lượt vừa bị đẩy ra khỏi cửa sổ thành một tóm tắt ngắn."""
+    prompt = f"""
+    Summarize this conversation between a user and a book assistant in at most
+    {SUMMARY_TOKEN_BUDGET * 3 // 4} words. Keep book titles, authors and the user's preferences.
+
+    Earlier summary:
+    {summary}
+
+    New messages:
+    {"".join(lines)}
+    """
+    response = runtime.get_gemini_model().generate_content(prompt)
+    return response.text.strip()
+
+
+class ConversationContext:
+    """Cửa sổ các tin nhắn gần nhất với tổng số token không vượt quá budget."""
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, summarizer=None):
+        self.budget = budget
+        self.summarizer = summarizer
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._window = deque()          # (dòng đã format, số token)
+        self._tokens = 0
+        self._evicted = []              # các dòng chờ được tóm tắt
+        self._summary = ""
+        self._summarizing = False
+        self._text = ""
+        self._dirty = False
+        self._seen = 0
+        self._last = None
+        self._generation = 0            # tăng khi reset để bỏ kết quả tóm tắt của lịch sử cũ
+
+    def append(self, msg):
+        line = _format_message(msg)
+        tokens = estimate_tokens(line)
+        with self._lock:
+            self._window.append((line, tokens))
+            self._tokens += tokens
+            # Luôn giữ tin nhắn mới nhất, kể cả khi riêng nó đã gần hết budget
+            while self._tokens > self.budget and len(self._window) > 1:
+                old_line, old_tokens = self._window.popleft()
+                self._tokens -= old_tokens
+                if self.summarizer:
+                    self._evicted.append(old_line)
+            self._dirty = True
+        if self._evicted:
+            self._summarize_in_background()
+
+    def sync(self, chat_history):
+        """Nạp các tin nhắn mới của chat_history; dựng lại từ đầu nếu lịch sử đã bị xóa/thay thế."""
+        with self._sync_lock:
+            if self._seen > len(chat_history) or (self._seen and chat_history[self._seen - 1] is not self._last):
+                # Lịch sử bị cắt bớt ở đầu (session_store đẩy lượt cũ ra đĩa): đi tiếp từ tin nhắn cuối đã nạp
+                position = self._position(chat_history)
+                if position is None:
+                    self.reset()
+                else:
+                    self._seen = position + 1
+            for msg in chat_history[self._seen:]:
+                self.append(msg)
+            self._seen = len(chat_history)
+            self._last = chat_history[-1] if chat_history else None
+
+    def _position(self, chat_history):
+        if self._last is None:
+            return None
+        for i in range(len(chat_history) - 1, -1, -1):
+            if chat_history[i] is self._last:
+                return i
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._window.clear()
+            self._tokens = 0
+            self._evicted = []
+            self._summary = ""
+            self._text = ""
+            self._dirty = False
+            self._seen = 0
+            self._last = None
+            self._generation += 1
+
+    def _summarize_in_background(self):
+        # Tóm tắt chạy ở thread nền để không cộng thêm độ trễ vào lượt chat hiện tại
+        with self._lock:
+            if self._summarizing or not self._evicted:
+                return
+            self._summarizing = True
+            summary, lines, generation = self._summary, self._evicted, self._generation
+            self._evicted = []
+
+        def _run():
+            try:
+                new_summary = _truncate(self.summarizer(summary, lines), SUMMARY_TOKEN_BUDGET)
+            except Exception as e:
+                print(f"[WARN] chat history summary failed: {e}")
+                new_summary = summary
+            with self._lock:
+                self._summarizing = False
+                if generation == self._generation:
+                    self._summary = new_summary
+                    self._dirty = True
+            if self._evicted:
+                self._summarize_in_background()
+
+        threading.Thread(target=_run, name="chat-summary", daemon=True).start()
+
+    def text(self):
+        """Đoạn lịch sử để chèn vào prompt (được cache cho tới khi có thay đổi)."""
+        with self._lock:
+            if self._dirty:
+                summary = f"Summary of earlier conversation: {self._summary}\n" if self._summary else ""
+                self._text = summary + "".join(line for line, _ in self._window)
+                self._dirty = False
+            return self._text
+
+    def stats(self):
+        with self._lock:
+            return {"messages": len(self._window), "tokens": self._tokens,
+                    "summary_tokens": estimate_tokens(self._summary) if self._summary else 0}
+
+    def memory_bytes(self):
+        """Ước lượng số byte bộ nhớ của cửa sổ, tóm tắt và chuỗi đã cache."""
+        with self._lock:
+            lines = [line for line, _ in self._window] + self._evicted
+            return (sys.getsizeof(self._window) + sum(sys.getsizeof(line) for line in lines)
+                    + sys.getsizeof(self._summary) + sys.getsizeof(self._text))
+
+
+_contexts_lock = threading.Lock()
+
+
+def get_context(chat_history):
+    """Context của chat_history.
+
+    Lịch sử của session (session_store.ChatHistory) giữ context của chính nó nên context sống
+    và được giải phóng cùng session; list thường nhận một context tạm mỗi lần (dựng lại từ đầu).
+    """
+    if not hasattr(chat_history, "context"):
+        return ConversationContext()    # không tóm tắt: kết quả không được giữ lại
+    with _contexts_lock:
+        if chat_history.context is None:
+            summarizer = gemini_summarizer if SUMMARIZE_OLD_TURNS else None
+            chat_history.context = ConversationContext(summarizer=summarizer)
+        return chat_history.context
+
+
+def format_chat_history(chat_history):
+    """Chuyển đổi lịch sử chat từ Streamlit sang định dạng văn bản, giới hạn theo số token"""
+    if not chat_history:
+        return ""
+    context = get_context(chat_history)
+    context.sync(chat_history)
+    return context.text()
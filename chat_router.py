@@ -0,0 +1,36 @@
+import runtime
+import tracing
+from book_info_agent import get_book_info
+from book_recommendation_agent import recommend_books
+from book_tracker import track_books
+from small_talk_agent import small_talker
+
+# Định tuyến query tới agent phù hợp; tách khỏi main.py để dùng được ngoài Streamlit (benchmark...)
+
+
+def router(query: str, history, session_id=None, stream=False, user_id="default"):
+    """Chọn agent theo route của query và trả về câu trả lời (str hoặc generator khi stream=True)"""
+    print(">Router")
+    with tracing.span("route") as span:
+        route = runtime.get_route_layer()(query)
+        span.set(route=route.name)
+
+    if route.name == 'small_talk':
+        print("small talking")
+        return small_talker(query, history, session_id=session_id, stream=stream)
+
+    elif route.name == 'book_info':
+        print("Fetching book information")
+        return get_book_info(query, history, session_id=session_id, stream=stream)
+
+    elif route.name == 'book_recommendation':
+        print("Recommending books")
+        return recommend_books(query, history, session_id=session_id, stream=stream)
+
+    elif route.name == 'book_tracker':
+        print("Tracking books")
+        return track_books(query, history, user_id=user_id, session_id=session_id)
+
+    else:
+        print("no route selected")
+        return "Sorry, I don't have in it in my knowledge base. Can you try something else."
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+# Circuit breaker cho từng upstream: sau FAILURE_THRESHOLD lỗi liên tiếp thì ngừng gọi
+# trong COOLDOWN giây (trả lỗi ngay thay vì chờ timeout), hết cool-down thì cho một
+# lời gọi thử; thành công thì đóng mạch lại, thất bại thì mở tiếp một chu kỳ nữa.
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Upstream đang trong thời gian cool-down, lời gọi bị từ chối ngay."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._stats = {"rejected": 0, "opened": 0}
+
+    def allow(self):
+        """Có được gọi upstream không; khi hết cool-down chỉ cho đúng một lời gọi thử."""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._state = HALF_OPEN
+                return True
+            if self._state == CLOSED:
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open), skipping the call")
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats["opened"] += 1
+                    print(f"[WARN] circuit for {self.name} opened for {self.cooldown:.0f}s")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, state=self._state, failures=self._failures)
+
+
+def get(name):
+    """Circuit breaker dùng chung theo tên upstream (tạo khi cần)."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
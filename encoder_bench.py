@@ -0,0 +1,141 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchmark
+import perf_stats
+
+# So sánh các backend của encoder định tuyến (xem encoders.py): mỗi backend chạy trong một
+# process riêng để đo thời gian nạp, RSS và độ trễ encode đúng như một worker thật.
+# Quyết định route trên tập query có nhãn (data/bench_queries.jsonl) phải trùng với model fp32.
+REFERENCE_BACKEND = "torch"
+
+
+def measure(backend, threads, queries, repeat):
+    """Chạy trong process con: nạp encoder, định tuyến các query và đo độ trễ/bộ nhớ."""
+    import encoders
+    import route_index
+    from route import routes
+
+    rss_before = perf_stats.rss_mb()
+    start = time.perf_counter()
+    encoder = encoders.create_encoder(backend, threads)
+    load_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        layer = route_index.create_route_layer(encoder, routes, tmp)
+        decisions = [layer(query).name for query in queries]
+
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            encoder([query])
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    encoder(queries)
+    batch_seconds = time.perf_counter() - start
+
+    rss_after = perf_stats.rss_mb()
+    p50, p95, _ = perf_stats.percentiles(latencies)
+    return {
+        "backend": backend,
+        "threads": threads,
+        "load_s": load_seconds,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "batch_qps": len(queries) / batch_seconds,
+        "rss_mb": rss_after,
+        "encoder_rss_mb": None if rss_before is None or rss_after is None else rss_after - rss_before,
+        "peak_rss_mb": perf_stats.peak_rss_mb(),
+        "decisions": decisions,
+    }
+
+
+def _run_worker(backend, threads, args):
+    command = [sys.executable, __file__, "--worker", backend, "--threads", str(threads),
+               "--queries", args.queries, "--repeat", str(args.repeat)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(f"[ERROR] {backend} (threads={threads}) failed:\n{completed.stderr.strip()}", file=sys.stderr)
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _compare(result, reference, queries, labels):
+    decisions = result["decisions"]
+    result["agreement"] = sum(a == b for a, b in zip(decisions, reference["decisions"])) / len(queries)
+    result["accuracy"] = sum(a == b for a, b in zip(decisions, labels)) / len(queries)
+    result["mismatches"] = [
+        {"query": query, "fp32": expected, "got": got}
+        for query, expected, got in zip(queries, reference["decisions"], decisions)
+        if expected != got
+    ]
+
+
+def _print_report(results):
+    header = (f"{'backend':8} {'threads':>7} {'load s':>7} {'p50 ms':>7} {'p95 ms':>7} {'batch q/s':>9} "
+              f"{'RSS MB':>7} {'+enc MB':>7} {'agree':>6} {'acc':>6}")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        rss = "n/a" if result["rss_mb"] is None else f"{result['rss_mb']:.0f}"
+        encoder_rss = "n/a" if result["encoder_rss_mb"] is None else f"{result['encoder_rss_mb']:.0f}"
+        print(f"{result['backend']:8} {result['threads'] or 'auto':>7} {result['load_s']:>7.2f} "
+              f"{result['p50_ms']:>7.2f} {result['p95_ms']:>7.2f} {result['batch_qps']:>9.1f} "
+              f"{rss:>7} {encoder_rss:>7} {result['agreement']:>6.1%} {result['accuracy']:>6.1%}")
+    for result in results:
+        for mismatch in result["mismatches"]:
+            print(f"[MISMATCH] {result['backend']} threads={result['threads']}: {mismatch['query']!r} "
+                  f"fp32={mismatch['fp32']} got={mismatch['got']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare routing encoder backends: parity, latency and memory.")
+    parser.add_argument("--backends", default="torch,int8,onnx", help="comma separated backends to compare")
+    parser.add_argument("--threads", default="0", help="comma separated thread counts (0 = library default)")
+    parser.add_argument("--queries", default=benchmark.QUERIES_PATH, help="labelled queries (JSONL query/route)")
+    parser.add_argument("--repeat", type=int, default=5, help="single-query encodes per query")
+    parser.add_argument("--min-agreement", type=float, default=1.0,
+                        help="fail when route decisions agree with fp32 less often than this")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    with open(args.queries, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    queries = [item["query"] for item in items]
+    labels = [item["route"] for item in items]
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, int(args.threads), queries, args.repeat)))
+        return 0
+
+    backends = args.backends.split(",")
+    results = []
+    for threads in (int(value) for value in args.threads.split(",")):
+        # Mốc so sánh luôn là model fp32 với cùng số thread
+        reference = _run_worker(REFERENCE_BACKEND, threads, args)
+        if reference is None:
+            return 1
+        for backend in backends:
+            result = reference if backend == REFERENCE_BACKEND else _run_worker(backend, threads, args)
+            if result is not None:
+                _compare(result, reference, queries, labels)
+                results.append(result)
+            print(f"[encoder_bench] {backend} threads={threads} done", file=sys.stderr)
+
+    _print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    failed = len(results) < len(backends) * len(args.threads.split(","))
+    failed = failed or any(result["agreement"] < args.min_agreement for result in results)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+from typing import Any, Optional
+
+import numpy as np
+from pydantic.v1 import PrivateAttr
+from semantic_router.encoders import BaseEncoder, HuggingFaceEncoder
+
+# Backend của encoder định tuyến trên CPU, chọn bằng ROUTE_ENCODER:
+# - "torch": HuggingFaceEncoder fp32 như trước
+# - "int8": cùng model torch, các lớp Linear được lượng tử hóa động sang int8
+# - "onnx": model đã export sang ONNX (mặc định lượng tử hóa int8) chạy bằng onnxruntime,
+#   không import torch nên RSS của mỗi worker nhỏ hơn nhiều
+ENCODER_BACKEND = os.getenv("ROUTE_ENCODER", "torch")
+# Số thread cho phép nhân ma trận (0 = mặc định của thư viện, thường bằng số core)
+ENCODER_THREADS = int(os.getenv("ENCODER_THREADS", "0"))
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(".cache", "route_encoder_onnx"))
+BACKENDS = ("torch", "int8", "onnx")
+MAX_LENGTH = 512
+META_FILE = "meta.json"
+
+
+class TorchEncoder(HuggingFaceEncoder):
+    """HuggingFaceEncoder fp32 với số thread cấu hình được."""
+
+    threads: int = ENCODER_THREADS
+
+    def _initialize_hf_model(self):
+        tokenizer, model = super()._initialize_hf_model()
+        if self.threads > 0:
+            self._torch.set_num_threads(self.threads)
+        model.eval()
+        return tokenizer, model
+
+
+class QuantizedTorchEncoder(TorchEncoder):
+    """Model torch với các lớp Linear lượng tử hóa động sang int8 (chỉ chạy trên CPU)."""
+
+    type: str = "huggingface-int8"
+    device: Optional[str] = "cpu"
+
+    def _initialize_hf_model(self):
+        tokenizer, model = super()._initialize_hf_model()
+        model = self._torch.quantization.quantize_dynamic(
+            model, {self._torch.nn.Linear}, dtype=self._torch.qint8
+        )
+        return tokenizer, model
+
+
+class OnnxEncoder(BaseEncoder):
+    """Encoder chạy model ONNX đã export bằng `python encoders.py --export` trên onnxruntime.
+
+    Mean pooling và chuẩn hóa L2 giống HuggingFaceEncoder, làm bằng numpy.
+    """
+
+    name: str = HuggingFaceEncoder.__fields__["name"].default
+    type: str = "onnx"
+    score_threshold: float = 0.5
+    model_dir: str = ONNX_MODEL_DIR
+    threads: int = ENCODER_THREADS
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: Any = PrivateAttr()
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "The onnx encoder backend needs onnxruntime and tokenizers. "
+                "You can install them with: `pip install onnxruntime tokenizers`"
+            )
+
+        meta_path = os.path.join(self.model_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"{meta_path} not found, export the model with: python encoders.py --export")
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["model"] != self.name:
+            raise ValueError(f"{self.model_dir} holds {meta['model']}, not {self.name}; export it again")
+        # Index route build bằng model fp32 và int8 khác nhau một chút nên cần fingerprint riêng
+        self.type = "onnx-int8" if meta["quantized"] else "onnx"
+
+        options = onnxruntime.SessionOptions()
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(self.model_dir, meta["model_file"]), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {item.name for item in self._session.get_inputs()}
+
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(meta["max_length"])
+        tokenizer.enable_padding(pad_id=meta["pad_id"], pad_token=meta["pad_token"])
+        self._tokenizer = tokenizer
+
+    def __call__(self, docs, batch_size=32):
+        all_embeddings = []
+        for i in range(0, len(docs), batch_size):
+            encodings = self._tokenizer.encode_batch(docs[i:i + batch_size])
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                "attention_mask": attention_mask,
+            }
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+            token_embeddings = self._session.run(None, feeds)[0]        # (batch, sequence, hidden)
+
+            mask = attention_mask[:, :, None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            all_embeddings.extend(embeddings.tolist())
+        return all_embeddings
+
+
+def create_encoder(backend=ENCODER_BACKEND, threads=ENCODER_THREADS):
+    """Tạo encoder định tuyến theo backend ("torch", "int8" hoặc "onnx")."""
+    if backend == "torch":
+        return TorchEncoder(threads=threads)
+    if backend == "int8":
+        return QuantizedTorchEncoder(threads=threads)
+    if backend == "onnx":
+        return OnnxEncoder(threads=threads)
+    raise ValueError(f"Unknown encoder backend {backend!r}, use one of: {', '.join(BACKENDS)}")
+
+
+def export_onnx(model_name=OnnxEncoder.__fields__["name"].default, path=ONNX_MODEL_DIR, quantize=True):
+    """Export model HuggingFace sang ONNX và lượng tử hóa động int8.
+
+    Chỉ chạy một lần khi build (cần torch, transformers và onnxruntime); lúc chạy backend
+    "onnx" chỉ cần onnxruntime và tokenizers.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(path, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    sample = tokenizer(["Tell me about The Hobbit"], padding=True, truncation=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    fp32_file = "model-fp32.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            os.path.join(path, fp32_file),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    model_file = fp32_file
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        model_file = "model-int8.onnx"
+        quantize_dynamic(os.path.join(path, fp32_file), os.path.join(path, model_file), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(path)
+    meta = {
+        "model": model_name,
+        "model_file": model_file,
+        "quantized": quantize,
+        "pad_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "max_length": min(tokenizer.model_max_length, MAX_LENGTH),
+    }
+    with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"[encoders] exported {model_name} -> {os.path.join(path, model_file)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the routing encoder for the onnx backend.")
+    parser.add_argument("--export", action="store_true", help="export the model to ONNX")
+    parser.add_argument("--path", default=ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="keep fp32 weights in the ONNX model")
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx(path=args.path, quantize=not args.no_quantize)
+    else:
+        parser.print_help()
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import re
+import threading
+
+import runtime
+import tracing
+from chat_context import format_chat_history
+
+# Gộp các lời gọi trích xuất Gemini của nhiều session đến gần nhau: các yêu cầu chờ tối đa
+# EXTRACTION_BATCH_WAIT giây (hoặc tới khi đủ EXTRACTION_BATCH_SIZE yêu cầu) rồi được gửi
+# chung trong một prompt, phần hướng dẫn và examples chỉ xuất hiện một lần.
+# EXTRACTION_BATCH_SIZE=1 tắt tính năng gộp.
+BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "8"))
+BATCH_WAIT = float(os.getenv("EXTRACTION_BATCH_WAIT", "0.05"))
+
+BATCH_PROMPT = """
+    You are an intelligent assistant that extracts book-related information from user queries.
+    Below are {count} independent requests, each with its own conversation history.
+    For every request extract {{"book_name": "...", "author_name": "...", "genre": "..."}}.
+    If a field is unknown, use null.
+
+    {examples}
+    {requests}
+    Respond only with a JSON array of exactly {count} objects, one per request, in the same order.
+    Only return JSON:
+    """
+
+REQUEST_TEMPLATE = """
+    Request {number} history:
+    {history}
+    Request {number} User Input: {user_input}
+"""
+
+_batchers = []
+_batchers_lock = threading.Lock()
+
+
+def build_batch_prompt(examples, requests):
+    """Prompt cho nhiều yêu cầu trích xuất [(user_input, chat_history)]."""
+    parts = [
+        REQUEST_TEMPLATE.format(
+            number=number,
+            history=format_chat_history(chat_history) if chat_history else "(none)",
+            user_input=user_input,
+        )
+        for number, (user_input, chat_history) in enumerate(requests, 1)
+    ]
+    return BATCH_PROMPT.format(count=len(requests), examples=examples, requests="".join(parts))
+
+
+def parse_batch(text, count):
+    """Lấy mảng JSON trong phản hồi; trả về list count phần tử (None nếu phần tử không hợp lệ) hoặc None."""
+    match = re.search(r'\[.*\]', text.strip(), re.DOTALL)
+    if not match:
+        return None
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != count:
+        return None
+    return [item if isinstance(item, dict) else None for item in items]
+
+
+class ExtractionBatcher:
+    """Gom các yêu cầu trích xuất đang chờ trên event loop thành một lời gọi Gemini.
+
+    single(user_input, chat_history) là coroutine trích xuất một yêu cầu, dùng khi lô chỉ có
+    một yêu cầu hoặc khi không đọc được kết quả của lời gọi gộp.
+    """
+
+    def __init__(self, name, examples, single, max_batch=BATCH_SIZE, max_wait=BATCH_WAIT):
+        self.name = name
+        self.examples = examples
+        self.single = single
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = {}      # loop -> [(user_input, chat_history, future)]
+        self._timers = {}       # loop -> TimerHandle
+        self._stats = {"requests": 0, "gemini_calls": 0, "batches": 0, "fallbacks": 0}
+        with _batchers_lock:
+            _batchers.append(self)
+
+    async def submit(self, user_input, chat_history=None):
+        if self.max_batch <= 1:
+            self._stats["requests"] += 1
+            self._stats["gemini_calls"] += 1
+            return await self.single(user_input, chat_history)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append((user_input, chat_history, future))
+        self._stats["requests"] += 1
+        if len(pending) >= self.max_batch:
+            self._flush(loop)
+        elif loop not in self._timers:
+            self._timers[loop] = loop.call_later(self.max_wait, self._flush, loop)
+
+        # Caller bị hủy không làm hỏng kết quả của các yêu cầu khác trong lô
+        result, batch_size = await asyncio.shield(future)
+        span = tracing.current_span()
+        if span is not None:
+            span.set(batch_size=batch_size)
+        return result
+
+    def _flush(self, loop):
+        timer = self._timers.pop(loop, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(loop, [])
+        if batch:
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            if len(batch) == 1:
+                user_input, chat_history, _ = batch[0]
+                self._stats["gemini_calls"] += 1
+                results = [await self.single(user_input, chat_history)]
+            else:
+                results = await self._run_batch(batch)
+        except asyncio.CancelledError:
+            for _, _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            # Lỗi đã được chuyển cho từng caller; task này không ai await nên không raise lại
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result((result, len(batch)))
+
+    async def _run_batch(self, batch):
+        requests = [(user_input, chat_history) for user_input, chat_history, _ in batch]
+        self._stats["batches"] += 1
+        self._stats["gemini_calls"] += 1
+        with tracing.span("extract.gemini.batch", size=len(batch)):
+            try:
+                response = await runtime.get_gemini_model().generate_content_async(
+                    build_batch_prompt(self.examples, requests)
+                )
+            except Exception as e:
+                return [{"error": f"Gemini error: {str(e)}"}] * len(batch)
+            results = parse_batch(response.text, len(batch))
+
+        if results is None:
+            print(f"[WARN] {self.name}: could not parse batched extraction, falling back to single calls")
+            results = [None] * len(batch)
+        retry = [i for i, result in enumerate(results) if result is None]
+        if retry:
+            self._stats["fallbacks"] += len(retry)
+            self._stats["gemini_calls"] += len(retry)
+            singles = await asyncio.gather(*(self.single(*requests[i]) for i in retry))
+            for i, result in zip(retry, singles):
+                results[i] = result
+        return results
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["saved_calls"] = stats["requests"] - stats["gemini_calls"]
+        return stats
+
+
+def batching_stats():
+    """Số yêu cầu trích xuất, số lời gọi Gemini thật sự và số lô của từng batcher."""
+    with _batchers_lock:
+        batchers = list(_batchers)
+    return {batcher.name: batcher.stats() for batcher in batchers}
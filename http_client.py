@@ -0,0 +1,128 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import budget
+import circuit_breaker
+import tracing
+
+# HTTP client dùng chung cho tất cả agent: giữ kết nối (keep-alive) theo từng host,
+# timeout thống nhất, retry có backoff ngẫu nhiên và giới hạn số request đồng thời mỗi host.
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+BACKOFF_BASE = 0.3
+BACKOFF_MAX = 3.0
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+MAX_CONCURRENCY_PER_HOST = int(os.getenv("HTTP_MAX_CONCURRENCY_PER_HOST", "8"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = "BookCompanionChatbot/1.0"
+
+_session = None
+_session_lock = threading.Lock()
+_host_limits = {}
+
+
+def get_session():
+    """Tạo một requests.Session duy nhất cho cả process (lazy)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"User-Agent": USER_AGENT})
+                _session = session
+    return _session
+
+
+def set_session(session):
+    """Thay session dùng chung (benchmark ghi/phát lại response)."""
+    global _session
+    with _session_lock:
+        _session = session
+
+
+def _host_semaphore(url):
+    host = urlparse(url).netloc
+    with _session_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(MAX_CONCURRENCY_PER_HOST)
+        return _host_limits[host]
+
+
+def _backoff(attempt, response=None):
+    """Full jitter backoff; tôn trọng header Retry-After nếu có."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def get(url, params=None, timeout=None):
+    """GET qua session dùng chung, retry khi lỗi kết nối/timeout hoặc status 429/5xx.
+
+    Host lỗi liên tục sẽ bị circuit breaker chặn (CircuitOpenError) trong thời gian cool-down.
+    Trong một lượt chat, timeout và số lần retry bị giới hạn bởi thời gian còn lại của budget.Deadline.
+    """
+    session = get_session()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    semaphore = _host_semaphore(url)
+    host = urlparse(url).netloc
+    deadline = budget.current()
+    if deadline is not None and deadline.remaining() <= 0:
+        raise requests.Timeout(f"turn budget spent before GET {host}")
+    breaker = circuit_breaker.get(host)
+    breaker.check()
+
+    with tracing.span("http", host=host) as span:
+        try:
+            response = _get_with_retries(session, url, params, timeout, semaphore, span, deadline)
+        except Exception:
+            # Hết ngân sách của lượt chat không phải lỗi của host
+            if deadline is None or deadline.remaining() > 0:
+                breaker.record_failure()
+            raise
+        if response.status_code in RETRY_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+
+def _capped(timeout, deadline):
+    """Timeout không vượt quá thời gian còn lại của deadline."""
+    if deadline is None:
+        return timeout
+    remaining = max(deadline.remaining(), 0.01)
+    if isinstance(timeout, tuple):
+        return tuple(min(value, remaining) for value in timeout)
+    return min(timeout, remaining)
+
+
+def _get_with_retries(session, url, params, timeout, semaphore, span, deadline=None):
+    for attempt in range(MAX_RETRIES + 1):
+        span.set(attempts=attempt + 1)
+        try:
+            with semaphore:
+                response = session.get(url, params=params, timeout=_capped(timeout, deadline))
+        except (requests.ConnectionError, requests.Timeout):
+            pause = _backoff(attempt)
+            if attempt == MAX_RETRIES or (deadline is not None and pause >= deadline.remaining()):
+                raise
+        else:
+            pause = _backoff(attempt, response)
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES \
+                    or (deadline is not None and pause >= deadline.remaining()):
+                span.set(status=response.status_code)
+                return response
+            response.close()
+        time.sleep(pause)
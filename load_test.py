@@ -0,0 +1,260 @@
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+import benchmark
+import perf_stats
+import session_store
+
+# Load test headless: N session giả lập (mỗi session một thread như Streamlit, có lịch sử chat riêng)
+# gửi xen kẽ query small talk / thông tin sách / gợi ý qua router. Open Library và Wikipedia
+# được phục vụ bởi stub server HTTP chạy local nên connection pool, retry và giới hạn
+# theo host của http_client vẫn được dùng thật; Gemini được thay bằng ReplayModel.
+DEFAULT_LEVELS = "1,4,16,32"
+SAMPLE_INTERVAL = 0.05
+QUERY_ROUTES = ("small_talk", "book_info", "book_recommendation")
+
+
+class StubServer:
+    """HTTP server local trả về fixture: GET /<host>/<path>?<query> ứng với https://<host>/<path>?<query>."""
+
+    def __init__(self, fixtures, latency):
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive để pool của http_client được dùng lại
+
+            def do_GET(self):
+                latency.sleep()
+                entry = fixtures.get(benchmark.request_key("https:/" + self.path))
+                status, data = (entry["status"], entry["json"]) if entry else (404, {})
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name="stub-server", daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+class StubAdapter(HTTPAdapter):
+    """Chuyển request https://<host>/... tới stub server, giữ nguyên pool/keep-alive của requests."""
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = f"{self.base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+        return super().send(request, **kwargs)
+
+
+def _install(args, fixtures):
+    import http_client
+    import runtime
+
+    server = StubServer(fixtures["http"], benchmark.Latency(args.http_latency, args.jitter, args.seed))
+    session = http_client.get_session()
+    session.mount("https://", StubAdapter(server.base_url, pool_connections=8, pool_maxsize=http_client.POOL_SIZE))
+    runtime.override_gemini_model(benchmark.ReplayModel(
+        fixtures["gemini"],
+        benchmark.Latency(args.gemini_latency, args.jitter, args.seed + 1),
+        benchmark.Latency(args.chunk_latency, args.jitter, args.seed + 2),
+    ))
+    return server
+
+
+class Monitor:
+    """Lấy mẫu số thread, RSS và số job đang chờ trên executor của async_runtime trong lúc chạy."""
+
+    def __init__(self):
+        self.peak_threads = 0
+        self.peak_rss = None
+        self.peak_backlog = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-monitor", daemon=True)
+
+    def _run(self):
+        import async_runtime
+
+        while not self._stop.is_set():
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_backlog = max(self.peak_backlog, async_runtime.backlog())
+            rss = perf_stats.rss_mb()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0.0, rss)
+            self._stop.wait(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _session(session_no, queries, args, router, results, stores):
+    """Một người dùng: gửi args.turns query liên tiếp, lịch sử chat giữ trong SessionStore như main.py."""
+    rng = random.Random(args.seed * 100003 + session_no)
+    session_id = f"load-{session_no}"
+    store = session_store.SessionStore(session_id)
+    for _ in range(args.turns):
+        query = rng.choice(queries)
+        store.append("user", query)
+        start = time.perf_counter()
+        failed = False
+        try:
+            response = router(query, store.messages, session_id, stream=args.stream, user_id=session_id)
+            if not isinstance(response, str):
+                response = "".join(response)
+            failed = bool(benchmark.ERROR_RESPONSE.match(response))
+        except Exception as e:
+            print(f"[ERROR] session {session_no}: {e}", file=sys.stderr)
+            response, failed = "", True
+        results.append((time.perf_counter() - start, failed))
+        store.append("assistant", response)
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+    stores.append(store)
+
+
+def _coalesced_calls():
+    import singleflight
+
+    return sum(stats["coalesced"] for stats in singleflight.coalescing_stats().values())
+
+
+def _extraction_calls():
+    import gemini_batcher
+
+    stats = gemini_batcher.batching_stats().values()
+    return sum(item["requests"] for item in stats), sum(item["gemini_calls"] for item in stats)
+
+
+def _prefetch_counts():
+    import prefetch
+
+    stats = prefetch.prefetch_stats()
+    return {name: stats[name] for name in ("speculated", "hits", "wasted", "warmed", "warm_hits")}
+
+
+def run_level(sessions, queries, args, router):
+    benchmark.reset_caches()
+    coalesced_before = _coalesced_calls()
+    extractions_before = _extraction_calls()
+    prefetch_before = _prefetch_counts()
+    results = []
+    stores = []
+    rss_before = perf_stats.rss_mb()
+    threads = [
+        threading.Thread(target=_session, args=(i, queries, args, router, results, stores), name=f"session-{i}")
+        for i in range(sessions)
+    ]
+    with Monitor() as monitor:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    p50, p95, p99 = perf_stats.percentiles(latencies)
+    return {
+        "sessions": sessions,
+        "turns": len(results),
+        "errors": sum(failed for _, failed in results),
+        "throughput_tps": len(results) / elapsed,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "peak_threads": monitor.peak_threads,
+        "peak_executor_backlog": monitor.peak_backlog,
+        "rss_growth_mb": None if rss_before is None or monitor.peak_rss is None else monitor.peak_rss - rss_before,
+        "coalesced_calls": _coalesced_calls() - coalesced_before,
+        "extraction_requests": _extraction_calls()[0] - extractions_before[0],
+        "extraction_gemini_calls": _extraction_calls()[1] - extractions_before[1],
+        "session_history_kb": max((store.memory_bytes() for store in stores), default=0) / 1024,
+        "prefetch": {name: count - prefetch_before[name] for name, count in _prefetch_counts().items()},
+    }
+
+
+def _print_report(levels):
+    header = (f"{'sessions':>8} {'turns':>6} {'err':>4} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'threads':>7} {'backlog':>7} {'+RSS MB':>8} {'coalesced':>9} {'extract':>9} {'hist KB':>7}")
+    print(header)
+    print("-" * len(header))
+    for level in levels:
+        rss = "n/a" if level["rss_growth_mb"] is None else f"{level['rss_growth_mb']:.1f}"
+        print(f"{level['sessions']:>8} {level['turns']:>6} {level['errors']:>4} {level['throughput_tps']:>8.2f} "
+              f"{level['p50_ms']:>8.1f} {level['p95_ms']:>8.1f} {level['p99_ms']:>8.1f} "
+              f"{level['peak_threads']:>7} {level['peak_executor_backlog']:>7} {rss:>8} {level['coalesced_calls']:>9} "
+              f"{level['extraction_gemini_calls']:>4}/{level['extraction_requests']:<4} "
+              f"{level['session_history_kb']:>7.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent chat sessions against local stub servers.")
+    parser.add_argument("--sessions", default=DEFAULT_LEVELS, help="comma separated concurrency levels")
+    parser.add_argument("--turns", type=int, default=5, help="queries per session")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between turns (seconds)")
+    parser.add_argument("--queries", default=benchmark.QUERIES_PATH)
+    parser.add_argument("--fixtures", default=benchmark.FIXTURES_PATH)
+    parser.add_argument("--gemini-latency", type=float, default=0.4)
+    parser.add_argument("--chunk-latency", type=float, default=0.03)
+    parser.add_argument("--http-latency", type=float, default=0.15)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--catalog", action="store_true", help="use the offline catalog instead of the stub servers")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    with open(args.queries, encoding="utf-8") as f:
+        queries = [item["query"] for item in map(json.loads, filter(str.strip, f)) if item["route"] in QUERY_ROUTES]
+    with open(args.fixtures, encoding="utf-8") as f:
+        fixtures = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args.record = False
+        benchmark.isolate(args, tmp)
+        server = _install(args, fixtures)
+        import runtime
+        from chat_router import router
+
+        runtime.get_route_layer()
+        levels = []
+        try:
+            for sessions in (int(value) for value in args.sessions.split(",")):
+                levels.append(run_level(sessions, queries, args, router))
+                print(f"[load_test] {sessions} sessions done", file=sys.stderr)
+        finally:
+            server.close()
+
+    _print_report(levels)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "levels": levels}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
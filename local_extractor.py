@@ -0,0 +1,249 @@
+import asyncio
+import json
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+
+import async_runtime
+import tracing
+
+# Trích xuất tên sách/tác giả/thể loại tại chỗ bằng gazetteer, trước khi gọi Gemini.
+# Chỉ khi độ tin cậy thấp (không khớp, câu hỏi tham chiếu lịch sử...) mới cần Gemini.
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.json")
+)
+CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_EXTRACTION_THRESHOLD", "0.8"))
+FUZZY_MIN_RATIO = 0.9
+MAX_LEARNED = 5000
+
+ARTICLES = {"the", "a", "an"}
+# Các từ cho thấy câu hỏi phụ thuộc vào ngữ cảnh hội thoại trước đó
+REFERENCE_WORDS = {
+    "it", "this", "that", "these", "those", "them", "they", "he", "she", "his", "her",
+    "more", "another", "same", "previous", "above", "last", "one",
+}
+
+_lock = threading.Lock()
+_titles = {}    # tuple token -> (tên sách, tác giả), từ gazetteer
+_learned_titles = {}    # như _titles nhưng học từ Gemini, chỉ dùng để khớp chính xác cụm nhiều từ
+_fuzzy_index = {}       # (số từ, chữ cái đầu) -> [(tuple token, chuỗi)], chỉ tên sách gazetteer
+_authors = {}   # tuple token -> tên tác giả
+_genres = {}    # tuple token -> thể loại
+_learned = 0
+_loaded = False
+_stats = {"local": 0, "gemini": 0, "no_match": 0, "low_confidence": 0, "gemini_timeout": 0}
+
+
+def _tokens(text):
+    text = text.replace("’", "'")
+    return re.findall(r"[\w']+", text)
+
+
+def _norm(token):
+    return token.lower().replace("'", "")
+
+
+def _key(text):
+    return tuple(_norm(token) for token in _tokens(text))
+
+
+def _add_title(title, author=None, table=_titles):
+    key = _key(title)
+    if not key or len("".join(key)) < 3:
+        return
+    # Tên sách học được chỉ có một từ dễ trùng với từ thường nên không ghi nhớ
+    if table is _learned_titles and len(key) < 2:
+        return
+    table.setdefault(key, (title, author))
+    # "Great Gatsby" cũng khớp với "The Great Gatsby"
+    if key[0] in ARTICLES and len(key) > 2:
+        table.setdefault(key[1:], (title, author))
+    if author:
+        _add_author(author)
+
+
+def _add_author(author):
+    key = _key(author)
+    if key:
+        _authors.setdefault(key, author)
+
+
+def _load():
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        with open(GAZETTEER_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        for book in data.get("books", []):
+            _add_title(book["title"], book.get("author"))
+        for author in data.get("authors", []):
+            _add_author(author)
+        for keyword, genre in data.get("genres", {}).items():
+            _genres[_key(keyword)] = genre
+        # Index không đổi sau khi nạp nên _fuzzy_title đọc được mà không cần giữ _lock
+        for key in _titles:
+            if len(key) >= 2:
+                _fuzzy_index.setdefault((len(key), key[0][:1]), []).append((key, " ".join(key)))
+        _loaded = True
+
+
+def _find(table, words):
+    """Tìm cụm dài nhất trong table khớp liên tiếp với words; trả về (key, vị trí) hoặc None."""
+    best = None
+    for start in range(len(words)):
+        for end in range(len(words), start, -1):
+            key = tuple(words[start:end])
+            if key in table and (best is None or len(key) > len(best[0])):
+                best = (key, start)
+                break
+    return best
+
+
+def _title_confidence(key, start, original):
+    """Độ tin cậy của một tên sách khớp chính xác, dựa trên chữ hoa xung quanh."""
+    end = start + len(key)
+    if len(key) == 1 and not key[0].isdigit() and not original[start][:1].isupper():
+        # Tên sách một từ ("dune", "emma") dễ trùng với từ thường
+        return 0.6
+    confidence = 0.95 if len(key) > 1 else 0.9
+    # Chữ hoa ngay sau/trước có thể là một tên sách dài hơn ("Dune Messiah")
+    if end < len(original) and original[end][:1].isupper() and original[end] != "I":
+        confidence -= 0.3
+    # (bỏ qua từ đầu câu vì luôn viết hoa)
+    if start > 1 and original[start - 1][:1].isupper() and original[start - 1] != "I" \
+            and _norm(original[start - 1]) not in ARTICLES:
+        confidence -= 0.3
+    return confidence
+
+
+def _fuzzy_title(words):
+    """So khớp gần đúng (lỗi chính tả nhỏ) với các tên sách nhiều từ của gazetteer."""
+    best = None
+    for size in range(2, len(words) + 1):
+        for start in range(len(words) - size + 1):
+            bucket = _fuzzy_index.get((size, words[start][:1]))
+            if not bucket:
+                continue
+            candidate = " ".join(words[start:start + size])
+            matcher = SequenceMatcher(None, candidate)
+            for key, target in bucket:
+                # ratio() <= 2 * min / (tổng độ dài): bỏ qua sớm các tên dài/ngắn hơn hẳn
+                if 2 * min(len(candidate), len(target)) < FUZZY_MIN_RATIO * (len(candidate) + len(target)):
+                    continue
+                matcher.set_seq2(target)
+                if matcher.quick_ratio() < FUZZY_MIN_RATIO:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= FUZZY_MIN_RATIO and (best is None or ratio > best[1]):
+                    best = (key, ratio)
+    return best
+
+
+def refers_to_history(user_input):
+    """Câu hỏi có từ tham chiếu ("it", "that one", "more"...) tới ngữ cảnh trước đó hay không."""
+    return bool(REFERENCE_WORDS.intersection(_norm(token) for token in _tokens(user_input)))
+
+
+def extract(user_input, chat_history=None):
+    """Trích xuất {"book_name", "author_name", "genre"} tại chỗ, kèm độ tin cậy 0..1."""
+    _load()
+    original = _tokens(user_input)
+    words = [_norm(token) for token in original]
+    info = {"book_name": None, "author_name": None, "genre": None}
+    confidence = 0.0
+
+    with _lock:
+        title = _find(_titles, words)
+        learned = _find(_learned_titles, words)
+        if learned and (title is None or len(learned[0]) > len(title[0])):
+            title = learned
+        author = _find(_authors, words)
+        genre = _find(_genres, words)
+        if title:
+            info["book_name"] = _titles.get(title[0], _learned_titles.get(title[0]))[0]
+            confidence = _title_confidence(title[0], title[1], original)
+        if author:
+            info["author_name"] = _authors[author[0]]
+            confidence = max(confidence, 0.9)
+        if genre:
+            info["genre"] = _genres[genre[0]]
+            confidence = max(confidence, 0.85)
+
+    if not title:
+        fuzzy = _fuzzy_title(words)
+        if fuzzy:
+            info["book_name"] = _titles[fuzzy[0]][0]
+            confidence = max(confidence, fuzzy[1] - 0.1)
+
+    # Câu hỏi kiểu "give me more like that" cần Gemini đọc lịch sử hội thoại
+    if chat_history and not title and refers_to_history(user_input):
+        confidence -= 0.3
+    return info, max(confidence, 0.0)
+
+
+def learn(extracted_info):
+    """Ghi nhớ tên sách/tác giả mà Gemini trích xuất được để lần sau khỏi gọi lại."""
+    global _learned
+    _load()
+    book_name = extracted_info.get("book_name")
+    author_name = extracted_info.get("author_name")
+    with _lock:
+        if _learned >= MAX_LEARNED:
+            return
+        if isinstance(book_name, str) and book_name.strip():
+            _add_title(book_name.strip(), author_name if isinstance(author_name, str) else None, _learned_titles)
+            _learned += 1
+        elif isinstance(author_name, str) and author_name.strip():
+            _add_author(author_name.strip())
+            _learned += 1
+
+
+def _record(path):
+    with _lock:
+        _stats[path] += 1
+
+
+@tracing.traced("extract")
+async def aextract_book_info(user_input, chat_history, gemini_extract, timeout=None, speculate=None):
+    """Thử trích xuất tại chỗ trước; chỉ gọi gemini_extract khi độ tin cậy thấp.
+
+    Nếu Gemini không trả lời trong timeout giây thì dùng kết quả tại chỗ (nếu có).
+    speculate(info, user_input, chat_history) được gọi trước khi chờ Gemini để tra cứu sớm.
+    """
+    # So khớp gần đúng tốn CPU nên chạy trên executor, không chặn event loop dùng chung
+    info, confidence = await async_runtime.run_blocking(extract, user_input, chat_history)
+    if confidence >= CONFIDENCE_THRESHOLD:
+        _record("local")
+        tracing.current_span().set(path="local")
+        return info
+
+    _record("low_confidence" if confidence > 0 else "no_match")
+    _record("gemini")
+    tracing.current_span().set(path="gemini")
+    if speculate is not None:
+        speculate(info, user_input, chat_history)
+    try:
+        result = await asyncio.wait_for(gemini_extract(user_input, chat_history), timeout)
+    except asyncio.TimeoutError:
+        _record("gemini_timeout")
+        tracing.current_span().set(timed_out=True)
+        if any(info.values()):
+            return info
+        return {"error": "Sorry, I couldn't understand your question in time. Please try again."}
+    if "error" not in result:
+        learn(result)
+    return result
+
+
+def extraction_stats():
+    """Số lượt trích xuất theo từng đường (local/Gemini) và tỉ lệ tránh được lời gọi Gemini."""
+    with _lock:
+        stats = dict(_stats)
+    total = stats["local"] + stats["gemini"]
+    stats["local_hit_rate"] = stats["local"] / total if total else 0.0
+    return stats
+
+
+tracing.register_stats("extraction", extraction_stats)
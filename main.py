@@ -1,78 +1,107 @@
 import streamlit as st
-from route import rl
-from book_info_agent import get_book_info
-from book_recommendation_agent import recommend_books
-from small_talk_agent import small_talker
-# from book_tracker import init_book_db, track_books, view_books
+import async_runtime
+import runtime
+import session_store
+import tracing
+from book_tracker import init_book_db
+from chat_router import router
 import time
+import uuid
+
+# Nạp encoder/RouteLayer/Gemini ở thread nền, không chặn lần render đầu tiên
+runtime.warm_up()
+# Endpoint /metrics cho Prometheus khi đặt METRICS_PORT
+tracing.start_metrics_server()
 
 # Giao diện Sidebar
 st.sidebar.title("Book Companion Chatbot")
+if not runtime.is_ready():
+    st.sidebar.caption("Warming up models...")
+
+# Mỗi session có id riêng để hủy được task của lượt chat bị bỏ dở trên loop nền
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Lịch sử trò chuyện: cửa sổ gần nhất trong bộ nhớ (list[dict]), lượt cũ được đẩy ra đĩa
+if "chat_store" not in st.session_state:
+    st.session_state.chat_store = session_store.SessionStore(st.session_state.session_id)
+chat_store = st.session_state.chat_store
 
-# Lưu lịch sử trò chuyện dạng list[dict]
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+# Danh sách đọc gắn với ?user=<tên> trên URL (nếu có) để giữ được qua các session
+if "user_id" not in st.session_state:
+    st.session_state.user_id = st.query_params.get("user", st.session_state.session_id)
+init_book_db()
 
-# Hiển thị lịch sử
+# Hiển thị lịch sử: chỉ một trang tin nhắn gần nhất, tin cũ hơn được nạp khi người dùng yêu cầu
 def display_history(history):
     for msg in history:
         with st.chat_message(msg["role"]):
             st.write(msg["content"])
 
-display_history(st.session_state.chat_history)
-
-# Hàm định tuyến
-def router(query: str, history):
-    print(">Router")
-    route = rl(query)
-
-    if route.name == 'small_talk':
-        print("small talking")
-        return small_talker(query, history)
-
-    elif route.name == 'book_info':
-        print("Fetching book information")
-        return get_book_info(query, history)
-
-    elif route.name == 'book_recommendation':
-        print("Recommending books")
-        return recommend_books(query, history)
-
-    # elif route.name == 'book_tracker':
-    #     print("Tracking books")
-    #     response = track_books(query, history)
-    #     books = view_books()
-    #     if books:
-    #         st.write("Danh sách sách của bạn:")
-    #         st.dataframe(books)
-    #     else:
-    #         st.write("Chưa có sách nào được lưu.")
-    else:
-        print("no route selected")
-        return "Sorry, I don't have in it in my knowledge base. Can you try something else."
+if chat_store.has_older() and st.button("Load older messages"):
+    chat_store.load_older()
+display_history(chat_store.page())
+
+def with_first_token_timing(chunks, start, turn=None):
+    """Ghi lại thời gian tới token đầu tiên (time-to-first-token) của lượt chat"""
+    first = True
+    for chunk in chunks:
+        if first:
+            ttft_ms = (time.perf_counter() - start) * 1000
+            print(f"[timing] time to first token: {ttft_ms:.0f}ms")
+            if turn is not None:
+                turn.set(first_token_ms=round(ttft_ms, 2))
+            first = False
+        yield chunk
 
 # Nhận input từ người dùng
 user_input = st.chat_input("Aske me anything about books")
 
 if user_input:
-    st.session_state.chat_history.append({"role": "user", "content": user_input})
+    chat_store.append("user", user_input)
     with st.chat_message("user"):
         st.write(user_input)
 
-    response = router(user_input, st.session_state.chat_history)
+    start = time.perf_counter()
+    response = None
+    try:
+        with tracing.trace("turn", st.session_state.session_id) as turn:
+            response = router(user_input, chat_store.messages, st.session_state.session_id, stream=True,
+                              user_id=st.session_state.user_id)
 
-    st.session_state.chat_history.append({"role": "assistant", "content": response})
-    with st.chat_message("assistant"):
-        full_res = ""
-        holder = st.empty()
-        if response and isinstance(response, str):
-            for word in response.split():
-                full_res += word + " "
-                time.sleep(0.05)
-                holder.markdown(full_res + "▋")
-        holder.markdown(full_res)
+            # Hiển thị từng đoạn text ngay khi Gemini trả về
+            with st.chat_message("assistant"), tracing.span("render"):
+                if isinstance(response, str):
+                    st.markdown(response)
+                else:
+                    response = st.write_stream(with_first_token_timing(response, start, turn))
+    except BaseException:
+        # Người dùng gửi tin mới hoặc bấm nút khi câu trả lời đang stream: Streamlit dừng lượt này
+        # bằng exception tại lần gọi st tiếp theo, task trên loop nền phải được hủy theo
+        async_runtime.cancel(st.session_state.session_id)
+        if hasattr(response, "close"):
+            response.close()        # đóng cả stream Gemini đang mở
+        raise
+
+    chat_store.append("assistant", response)
 
 # Xóa lịch sử
 if st.sidebar.button("Clear Chat"):
-    st.session_state.chat_history.clear()
-    st.rerun() 
+    chat_store.clear()
+    st.rerun()
+
+# Bảng debug: thời gian từng giai đoạn của lượt gần nhất
+if st.sidebar.checkbox("Show latency breakdown"):
+    last = tracing.last_trace(st.session_state.session_id)
+    if last:
+        st.sidebar.dataframe(tracing.breakdown(last), hide_index=True)
+    else:
+        st.sidebar.caption("No turn traced yet.")
+
+# Tỉ lệ hit của các cache và của trích xuất tại chỗ (cũng có trên /metrics)
+if st.sidebar.checkbox("Show cache stats"):
+    st.sidebar.json(tracing.collected_stats())
+
+# Bộ nhớ lịch sử chat của session này và của cả process (để ước lượng số replica)
+if st.sidebar.checkbox("Show session memory"):
+    st.sidebar.json({"this_session": chat_store.stats(), "process": session_store.memory_report()})
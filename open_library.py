@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+import http_client
+
+# Tra cứu Open Library dùng chung cho các agent.
+# search.json chỉ yêu cầu các field cần dùng và 1 kết quả thay vì tải toàn bộ response.
+SEARCH_URL = "https://openlibrary.org/search.json"
+SEARCH_FIELDS = "key,title,author_name,first_publish_year,subject"
+WORK_DETAILS_MAX = 256
+
+_work_details = OrderedDict()
+_work_details_lock = threading.Lock()
+
+
+def search_first_work(query, fields=SEARCH_FIELDS):
+    """Trả về doc đầu tiên của search.json (chỉ gồm `fields`), hoặc None nếu không có."""
+    params = {"q": query, "fields": fields, "limit": 1}
+    response = http_client.get(SEARCH_URL, params=params)
+    response.raise_for_status()
+    docs = response.json().get("docs", [])
+    return docs[0] if docs else None
+
+
+def get_work_details(work_key):
+    """Lấy works/{id}.json, dùng lại kết quả đã tải cho cùng work key trong process."""
+    with _work_details_lock:
+        if work_key in _work_details:
+            _work_details.move_to_end(work_key)
+            return _work_details[work_key]
+
+    work_id = work_key.split("/")[-1]
+    response = http_client.get(f"https://openlibrary.org/works/{work_id}.json")
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    details = response.json()
+
+    with _work_details_lock:
+        _work_details[work_key] = details
+        if len(_work_details) > WORK_DETAILS_MAX:
+            _work_details.popitem(last=False)
+    return details
+
+
+def search_titles_by_author(author_name):
+    """Danh sách tiêu đề sách của một tác giả, chỉ tải field title."""
+    params = {"author": author_name.lower(), "fields": "title"}
+    response = http_client.get(SEARCH_URL, params=params)
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    return [doc["title"] for doc in response.json().get("docs", []) if "title" in doc]
+
+
+def clear_work_details():
+    """Xóa các work đã tải trong process."""
+    with _work_details_lock:
+        _work_details.clear()
@@ -0,0 +1,31 @@
+import os
+import statistics
+
+# Các phép đo dùng chung cho benchmark.py, load_test.py và encoder_bench.py.
+
+
+def percentiles(values):
+    """(p50, p95, p99) của values; danh sách ít hơn hai phần tử thì trả về chính phần tử đó."""
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def rss_mb():
+    """RSS hiện tại của process (MB); None nếu không có /proc (không phải Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """RSS cao nhất từ khi process khởi động (MB); None trên Windows."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+import local_extractor
+import response_cache
+import singleflight
+import tracing
+
+# Tra cứu trước (speculative prefetch):
+# - trong lúc chờ Gemini trích xuất, tên sách đoán được tại chỗ (từ câu hỏi hoặc lịch sử khi
+#   người dùng hỏi "it", "that one"...) được tra cứu song song; kết quả không dùng bị bỏ.
+# - sau khi trả lời về một cuốn sách, dữ liệu gợi ý cho cuốn đó được tải sẵn ở nền
+#   để câu hỏi tiếp theo kiểu "suggest similar books" không phải bắt đầu lại từ đầu.
+PREFETCH_ENABLED = os.getenv("PREFETCH", "1") != "0"
+MAX_CANDIDATES = 2
+HISTORY_MESSAGES = 4
+MAX_WARMED = 256
+
+_lock = threading.Lock()
+_stats = {"speculated": 0, "hits": 0, "wasted": 0, "warmed": 0, "warm_hits": 0, "warm_wasted": 0}
+_warmed = OrderedDict()     # tên sách đã chuẩn hóa -> {(func, tham số đã chuẩn hóa)} đã tải sẵn, chưa được dùng tới
+_background = set()
+
+
+def _count(**deltas):
+    with _lock:
+        for name, delta in deltas.items():
+            _stats[name] += delta
+
+
+def guess_titles(info, user_input, chat_history=None):
+    """Các tên sách có thể là đáp án của lời gọi trích xuất Gemini đang chờ."""
+    titles = [info["book_name"]] if info.get("book_name") else []
+    if chat_history and local_extractor.refers_to_history(user_input):
+        for message in reversed(chat_history[-HISTORY_MESSAGES:]):
+            if message.get("role") != "user" or message.get("content") == user_input:
+                continue
+            book_name = local_extractor.extract(message["content"])[0].get("book_name")
+            if book_name:
+                titles.append(book_name)
+                break
+
+    unique = []
+    for title in titles:
+        if response_cache.normalize_key(title) not in map(response_cache.normalize_key, unique):
+            unique.append(title)
+    return unique[:MAX_CANDIDATES]
+
+
+async def _prefetch(func, title):
+    with tracing.span("prefetch", title=title):
+        return await singleflight.run_blocking(func, title)
+
+
+class Speculation:
+    """Các tra cứu (func(title) blocking) được bắt đầu sớm trong một lượt chat.
+
+    Gọi discard() khi lượt chat kết thúc để bỏ các tra cứu không được dùng.
+    """
+
+    def __init__(self, lookups):
+        self.lookups = lookups
+        self._tasks = {}
+
+    def start(self, info, user_input, chat_history=None):
+        if not PREFETCH_ENABLED:
+            return
+        for title in guess_titles(info, user_input, chat_history):
+            for func in self.lookups:
+                key = (func, response_cache.normalize_key(title))
+                if key not in self._tasks:
+                    self._tasks[key] = asyncio.ensure_future(_prefetch(func, title))
+                    _count(speculated=1)
+
+    def get(self, func, title):
+        """Awaitable kết quả func(title): dùng lại tra cứu đã bắt đầu sớm nếu có."""
+        task = self._tasks.pop((func, response_cache.normalize_key(title)), None)
+        if task is None:
+            return singleflight.run_blocking(func, title)
+        _count(hits=1)
+        return task
+
+    def discard(self):
+        for task in self._tasks.values():
+            task.cancel()
+        _count(wasted=len(self._tasks))
+        self._tasks.clear()
+
+
+def warm_recommendations(book_name):
+    """Tải sẵn ở nền (ngoài lượt chat hiện tại) dữ liệu gợi ý sách cho book_name."""
+    if not PREFETCH_ENABLED or not book_name:
+        return
+    key = response_cache.normalize_key(book_name)
+    with _lock:
+        if key in _warmed:
+            _warmed.move_to_end(key)
+            return
+        _warmed[key] = set()
+        _stats["warmed"] += 1
+        while len(_warmed) > MAX_WARMED:
+            _warmed.popitem(last=False)
+            _stats["warm_wasted"] += 1
+
+    async def run():
+        import book_recommendation_agent  # import muộn: agent gợi ý cũng dùng module này
+
+        with tracing.trace("prefetch.warm", book=book_name):
+            await book_recommendation_agent.awarm_recommendations(book_name)
+
+    task = asyncio.ensure_future(run())
+    _background.add(task)
+    task.add_done_callback(_finish_warm)
+
+
+def _finish_warm(task):
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[WARN] prefetch failed: {task.exception()}")
+
+
+def record_warm(book_name, lookups):
+    """Ghi lại các tra cứu (func, arg) mà lượt tải sẵn cho book_name đã bắt đầu."""
+    with _lock:
+        warmed = _warmed.get(response_cache.normalize_key(book_name))
+        if warmed is not None:
+            warmed.update((func, response_cache.normalize_key(arg)) for func, arg in lookups)
+
+
+def claim_warm(book_name, lookups):
+    """Lượt gợi ý cho book_name sắp chạy lookups; chỉ tính warm hit khi có tra cứu đã được tải sẵn."""
+    with _lock:
+        warmed = _warmed.pop(response_cache.normalize_key(book_name), None)
+        if not warmed:
+            return
+        if warmed.intersection((func, response_cache.normalize_key(arg)) for func, arg in lookups):
+            _stats["warm_hits"] += 1
+        else:
+            _stats["warm_wasted"] += 1
+
+
+def prefetch_stats():
+    """Số tra cứu đoán trước / dùng được / bị bỏ, và tương tự cho dữ liệu gợi ý tải sẵn."""
+    with _lock:
+        stats = dict(_stats)
+        stats["warm_pending"] = len(_warmed)
+    stats["hit_rate"] = stats["hits"] / stats["speculated"] if stats["speculated"] else 0.0
+    return stats
@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+import singleflight
+import tracing
+
+# Cache dùng chung cho các agent, lưu trên đĩa bằng SQLite
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+
+DAY = 24 * 3600
+
+# TTL (giây) cho từng endpoint
+TTLS = {
+    "wikipedia": 7 * DAY,
+    "openlibrary_book": 7 * DAY,
+    "openlibrary_author_subjects": 7 * DAY,
+    "openlibrary_author": DAY,
+    "openlibrary_subject": DAY,
+}
+DEFAULT_TTL = DAY
+# Kết quả "không tìm thấy" chỉ giữ ngắn hạn
+NEGATIVE_TTL = 3600
+
+
+def normalize_key(*parts):
+    """Chuẩn hóa tham số thành khóa cache (không phân biệt hoa thường, khoảng trắng)."""
+    return "|".join(" ".join(str(part).lower().split()) for part in parts)
+
+
+def is_negative(value):
+    """Kết quả rỗng được coi là "không tìm thấy"."""
+    return value is None or value == [] or value == {}
+
+
+class ResponseCache:
+    """Cache key/value với TTL và loại bỏ theo LRU khi vượt quá max_entries."""
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _connect(self):
+        if self._conn is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            self._conn = conn
+        return self._conn
+
+    def _counter(self, namespace):
+        if namespace not in self._stats:
+            self._stats[namespace] = {
+                "hits": 0,
+                "negative_hits": 0,
+                "misses": 0,
+                "evictions": 0,
+                "miss_seconds": 0.0,
+            }
+        return self._stats[namespace]
+
+    def get(self, namespace, key):
+        """Trả về (found, value); found=False nếu chưa có hoặc đã hết hạn."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?",
+                (f"{namespace}:{key}",),
+            ).fetchone()
+            counter = self._counter(namespace)
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (f"{namespace}:{key}",))
+                counter["misses"] += 1
+                return False, None
+            conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?",
+                (now, f"{namespace}:{key}"),
+            )
+            value = json.loads(row[0])
+            counter["negative_hits" if is_negative(value) else "hits"] += 1
+            return True, value
+
+    def set(self, namespace, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (f"{namespace}:{key}", namespace, json.dumps(value, ensure_ascii=False), now + ttl, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Xóa các bản ghi ít được dùng nhất khi cache vượt quá kích thước."""
+        count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        rows = conn.execute(
+            "SELECT key, namespace FROM responses ORDER BY last_access ASC LIMIT ?",
+            (overflow,),
+        ).fetchall()
+        conn.executemany("DELETE FROM responses WHERE key = ?", [(row[0],) for row in rows])
+        for _, namespace in rows:
+            self._counter(namespace)["evictions"] += 1
+
+    def record_miss_latency(self, namespace, seconds):
+        with self._lock:
+            self._counter(namespace)["miss_seconds"] += seconds
+
+    def stats(self):
+        """Thống kê hit/miss theo endpoint, kèm ước lượng thời gian tiết kiệm được."""
+        with self._lock:
+            result = {}
+            for namespace, counter in self._stats.items():
+                hits = counter["hits"] + counter["negative_hits"]
+                avg_miss = counter["miss_seconds"] / counter["misses"] if counter["misses"] else 0.0
+                lookups = hits + counter["misses"]
+                result[namespace] = dict(
+                    counter,
+                    hit_rate=hits / lookups if lookups else 0.0,
+                    saved_seconds=hits * avg_miss,
+                    saved_requests=hits,
+                )
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM responses")
+
+
+response_cache = ResponseCache()
+
+
+def cached(namespace, ttl=None, negative_ttl=NEGATIVE_TTL):
+    """Decorator cache kết quả theo tham số; hàm trả về None/rỗng khi không tìm thấy.
+
+    Exception không được cache để lỗi mạng tạm thời không bị lưu lại. Các lời gọi đồng thời
+    cùng tham số được gộp (singleflight) nên chỉ một request đi ra ngoài.
+    """
+    ttl = ttl if ttl is not None else TTLS.get(namespace, DEFAULT_TTL)
+
+    flight = singleflight.group(namespace)
+
+    def decorator(func):
+        def fetch(key, *args):
+            start = time.perf_counter()
+            value = func(*args)
+            response_cache.record_miss_latency(namespace, time.perf_counter() - start)
+            response_cache.set(namespace, key, value, negative_ttl if is_negative(value) else ttl)
+            return value
+
+        @wraps(func)
+        def wrapper(*args):
+            key = normalize_key(*args)
+            found, value = response_cache.get(namespace, key)
+            if found:
+                return value
+            # Nhiều session cùng miss một khóa thì chỉ một lời gọi đi ra ngoài
+            return flight.do(key, fetch, key, *args)
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    return response_cache.stats()
+
+
+tracing.register_stats("response_cache", cache_stats)
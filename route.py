@@ -1,7 +1,7 @@
 # route.py
 
-from semantic_router import Route, RouteLayer
-from semantic_router.encoders import HuggingFaceEncoder
+from semantic_router import Route
+import runtime
 
 # 1. Định nghĩa các Route với utterance đa dạng hơn để bắt tốt hơn các câu hỏi thực tế
 small_talk = Route(
@@ -67,10 +67,6 @@ book_tracker = Route(
 # 2. Tập hợp các Route
 routes = [small_talk, book_info, book_recommendation, book_tracker]
 
-# 3. Khởi tạo bộ mã hóa và RouteLayer
-encoder = HuggingFaceEncoder()
-encoder.score_threshold = 0.3  # Có thể tinh chỉnh để kiểm soát độ nhạy
-
-rl = RouteLayer(encoder=encoder, routes=routes)
-
-
+# 3. RouteLayer được tạo lazy qua runtime (encoder chỉ nạp một lần mỗi process)
+def rl(text):
+    return runtime.get_route_layer()(text)
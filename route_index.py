@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+from semantic_router import RouteLayer
+
+# Index embedding của các utterance được tính sẵn và lưu trên đĩa,
+# khi khởi động chỉ cần memory-map thay vì encode lại toàn bộ route.
+INDEX_FORMAT_VERSION = 1
+ROUTE_INDEX_DIR = os.getenv("ROUTE_INDEX_DIR", os.path.join(".cache", "route_index"))
+META_FILE = "meta.json"
+
+
+def fingerprint(routes, encoder):
+    """Hash của định nghĩa route + cấu hình encoder; thay đổi thì phải build lại index."""
+    payload = {
+        "version": INDEX_FORMAT_VERSION,
+        "encoder": {"type": encoder.type, "name": encoder.name},
+        "routes": [
+            {"name": route.name, "utterances": route.utterances, "score_threshold": route.score_threshold}
+            for route in routes
+        ],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path, name, write, mode="wb"):
+    """Ghi file qua một file tạm riêng (nhiều replica có thể build cùng lúc) rồi os.replace."""
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=path)
+    try:
+        with open(fd, mode, encoding=None if "b" in mode else "utf-8") as f:
+            write(f)
+        os.replace(tmp_path, os.path.join(path, name))
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def build(routes, encoder, path=ROUTE_INDEX_DIR):
+    """Encode toàn bộ utterance và lưu ma trận embedding + metadata vào path.
+
+    Nếu không ghi được vào path thì vẫn trả về index trong bộ nhớ.
+    """
+    digest = fingerprint(routes, encoder)
+    utterances = [utterance for route in routes for utterance in route.utterances]
+    categories = [route.name for route in routes for _ in route.utterances]
+    embeddings = np.asarray(encoder(utterances), dtype=np.float32)
+
+    embeddings_file = f"embeddings-{digest[:16]}.npy"
+    meta = {
+        "version": INDEX_FORMAT_VERSION,
+        "fingerprint": digest,
+        "encoder_type": encoder.type,
+        "encoder_name": encoder.name,
+        "score_threshold": encoder.score_threshold,
+        "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        "embeddings_file": embeddings_file,
+        "categories": categories,
+    }
+    try:
+        os.makedirs(path, exist_ok=True)
+        # File embedding của bản khác (release cũ/mới đang chạy song song) được giữ nguyên
+        _write_atomic(path, embeddings_file, lambda f: np.save(f, embeddings))
+        _write_atomic(path, META_FILE, lambda f: json.dump(meta, f, indent=2), mode="w")
+    except OSError as e:
+        print(f"[WARN] route index not saved to {path}, using it in memory: {e}")
+    else:
+        print(f"[route_index] built {len(utterances)} utterances -> {path}")
+    return embeddings, np.array(categories)
+
+
+def load(routes, encoder, path=ROUTE_INDEX_DIR):
+    """Memory-map index đã build; trả về None nếu chưa có hoặc đã lỗi thời."""
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != fingerprint(routes, encoder):
+            return None
+        embeddings_path = os.path.join(path, meta["embeddings_file"])
+        if not os.path.exists(embeddings_path):
+            return None
+        embeddings = np.load(embeddings_path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print(f"[WARN] could not read route index in {path}: {e}")
+        return None
+    return embeddings, np.array(meta["categories"])
+
+
+def create_route_layer(encoder, routes, path=ROUTE_INDEX_DIR):
+    """Tạo RouteLayer từ index trên đĩa, chỉ encode lại khi định nghĩa route thay đổi."""
+    # Không truyền routes vào constructor để RouteLayer không tự encode utterance
+    layer = RouteLayer(encoder=encoder)
+    for route in routes:
+        if route.score_threshold is None:
+            route.score_threshold = layer.score_threshold
+    layer.routes = list(routes)
+
+    index = load(layer.routes, encoder, path)
+    if index is None:
+        built = build(layer.routes, encoder, path)
+        index = load(layer.routes, encoder, path) or built
+    layer.index, layer.categories = index
+    return layer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the precomputed route embedding index.")
+    parser.add_argument("--path", default=ROUTE_INDEX_DIR)
+    parser.add_argument("--force", action="store_true", help="rebuild even if the index is up to date")
+    args = parser.parse_args()
+
+    from route import routes
+    from runtime import get_encoder
+
+    encoder = get_encoder()
+    for route in routes:
+        if route.score_threshold is None:
+            route.score_threshold = encoder.score_threshold
+    if args.force or load(routes, encoder, args.path) is None:
+        build(routes, encoder, args.path)
+    else:
+        print(f"[route_index] {args.path} is up to date")
@@ -0,0 +1,97 @@
+import os
+import threading
+
+# Registry dùng chung cho cả process: các client nặng (Gemini, encoder, RouteLayer)
+# chỉ được tạo một lần, khi lần đầu cần tới hoặc khi warm_up() chạy nền lúc khởi động.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-lite")
+ROUTE_SCORE_THRESHOLD = float(os.getenv("ROUTE_SCORE_THRESHOLD", "0.3"))
+
+_instances = {}
+_locks = {}
+_registry_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def _get(name, factory):
+    """Tạo instance `name` bằng factory đúng một lần (thread-safe)."""
+    if name in _instances:
+        return _instances[name]
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        if name not in _instances:
+            _instances[name] = factory()
+    return _instances[name]
+
+
+def _configure_genai():
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    genai.configure(api_key=os.getenv("API_KEY"))
+    return genai
+
+
+def get_gemini_model(model_name=GEMINI_MODEL):
+    """GenerativeModel dùng chung cho tất cả agent."""
+    genai = _get("genai", _configure_genai)
+    return _get(f"gemini:{model_name}", lambda: genai.GenerativeModel(model_name))
+
+
+def override_gemini_model(model, model_name=GEMINI_MODEL):
+    """Thay GenerativeModel dùng chung (benchmark/load test phát lại response đã ghi sẵn).
+
+    Nếu genai chưa được cấu hình thì cũng không cấu hình nữa (không cần API key).
+    """
+    with _registry_lock:
+        _instances.setdefault("genai", None)
+        _instances[f"gemini:{model_name}"] = model
+
+
+def _create_encoder():
+    import encoders
+
+    encoder = encoders.create_encoder()  # backend chọn bằng ROUTE_ENCODER, số thread bằng ENCODER_THREADS
+    encoder.score_threshold = ROUTE_SCORE_THRESHOLD  # Có thể tinh chỉnh để kiểm soát độ nhạy
+    return encoder
+
+
+def get_encoder():
+    """Encoder định tuyến (torch/transformers hoặc onnxruntime chỉ được import ở đây)."""
+    return _get("encoder", _create_encoder)
+
+
+def _create_route_layer():
+    from route import routes
+    from route_index import create_route_layer
+
+    return create_route_layer(get_encoder(), routes)
+
+
+def get_route_layer():
+    """RouteLayer dùng index embedding đã build sẵn."""
+    return _get("route_layer", _create_route_layer)
+
+
+def warm_up():
+    """Khởi tạo các client ở thread nền để lần render đầu của main.py không bị chặn."""
+    global _warm_up_thread
+    with _registry_lock:
+        if _warm_up_thread is not None:
+            return _warm_up_thread
+
+        def _run():
+            try:
+                get_route_layer()
+                get_gemini_model()
+            except Exception as e:
+                print(f"[WARN] warm up failed: {e}")
+
+        _warm_up_thread = threading.Thread(target=_run, name="runtime-warm-up", daemon=True)
+        _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def is_ready():
+    return "route_layer" in _instances and f"gemini:{GEMINI_MODEL}" in _instances
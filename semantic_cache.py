@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+import async_runtime
+import local_extractor
+import runtime
+import tracing
+
+# Cache câu trả lời theo ngữ nghĩa: "Who wrote 1984?" và "author of 1984" có embedding gần nhau
+# nên dùng chung một câu trả lời, bỏ qua toàn bộ pipeline (trích xuất, tra cứu, Gemini).
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 3600)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+
+class SemanticCache:
+    """Các embedding được giữ trong một ma trận cố định để tìm kiếm bằng một phép nhân ma trận."""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL,
+                 max_entries=SEMANTIC_CACHE_MAX_ENTRIES, encoder=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._answers = [None] * max_entries
+        self._book_names = [None] * max_entries
+        self._latencies = np.zeros(max_entries)
+        self._expires = np.zeros(max_entries)       # 0 = slot trống
+        self._last_access = np.zeros(max_entries)
+        self._stats = {"hits": 0, "misses": 0, "skipped": 0, "stores": 0, "evictions": 0, "saved_seconds": 0.0}
+
+    def _embed(self, query):
+        encoder = self._encoder or runtime.get_encoder()
+        vector = np.asarray(encoder([query])[0], dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def prepare(self, query, chat_history=None):
+        """Tính khóa cache cho query; trả về None nếu không nên cache (phụ thuộc lịch sử chat)."""
+        earlier_turns = [msg for msg in (chat_history or [])[:-1] if msg.get("role") == "assistant"]
+        if earlier_turns and local_extractor.refers_to_history(query):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return None
+        # Tên sách trích xuất tại chỗ dùng để tránh nhầm "Who wrote 1984?" với "Who wrote Dune?"
+        book_name = local_extractor.extract(query)[0]["book_name"]
+        try:
+            embedding = self._embed(query)
+        except Exception as e:
+            print(f"[WARN] semantic cache disabled for this query: {e}")
+            return None
+        return {"embedding": embedding, "book_name": book_name, "started": time.perf_counter()}
+
+    def lookup(self, key):
+        """Trả về câu trả lời đã cache gần nhất với key (nếu vượt ngưỡng), ngược lại None."""
+        if key is None:
+            return None
+        now = time.time()
+        with self._lock:
+            if self._matrix is not None:
+                sims = self._matrix @ key["embedding"]
+                sims[self._expires <= now] = -1.0
+                for slot in np.argsort(-sims)[:5]:
+                    if sims[slot] < self.threshold:
+                        break
+                    if self._book_names[slot] != key["book_name"]:
+                        continue
+                    self._last_access[slot] = now
+                    self._stats["hits"] += 1
+                    self._stats["saved_seconds"] += self._latencies[slot]
+                    return self._answers[slot]
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, key, answer):
+        """Lưu câu trả lời cho key; slot trống hoặc ít dùng nhất (LRU) sẽ bị ghi đè."""
+        if key is None or not answer or answer.startswith("Error"):
+            return
+        now = time.time()
+        embedding = key["embedding"]
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(self._expires <= now)
+            if len(free):
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self._last_access))
+                self._stats["evictions"] += 1
+            self._matrix[slot] = embedding
+            self._answers[slot] = answer
+            self._book_names[slot] = key["book_name"]
+            self._latencies[slot] = time.perf_counter() - key["started"]
+            self._expires[slot] = now + self.ttl
+            self._last_access[slot] = now
+            self._stats["stores"] += 1
+
+    async def store_stream(self, key, chunks):
+        """Chuyển tiếp stream text và lưu toàn bộ câu trả lời khi stream kết thúc (trừ khi stream lỗi)."""
+        parts, failed = [], False
+        async for chunk in chunks:
+            failed = failed or isinstance(chunk, async_runtime.StreamError)
+            parts.append(chunk)
+            yield chunk
+        if not failed:
+            self.store(key, "".join(parts))
+
+    def clear(self):
+        with self._lock:
+            self._matrix = None
+            self._answers = [None] * self.max_entries
+            self._book_names = [None] * self.max_entries
+            self._expires[:] = 0
+            self._last_access[:] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = int(np.count_nonzero(self._expires > time.time()))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+semantic_cache = SemanticCache()
+tracing.register_stats("semantic_cache", semantic_cache.stats)
@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import weakref
+import zlib
+
+# Lịch sử chat của mỗi session Streamlit: chỉ giữ CHAT_MEMORY_MESSAGES tin nhắn gần nhất trong
+# bộ nhớ, các lượt cũ hơn được nén (zlib) theo từng khối và ghi ra SQLite. Giao diện chỉ hiển thị
+# một trang CHAT_PAGE_SIZE tin nhắn, "Load older messages" nạp thêm từ đĩa khi cần.
+MAX_IN_MEMORY = int(os.getenv("CHAT_MEMORY_MESSAGES", "40"))
+PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))
+# File chỉ dùng trong một process (session Streamlit không sống qua lần khởi động lại)
+SPILL_PATH = os.getenv(
+    "CHAT_SPILL_PATH", os.path.join(tempfile.gettempdir(), f"chat-sessions-{os.getpid()}.sqlite3")
+)
+
+_conn = None
+_lock = threading.Lock()
+_stores = weakref.WeakSet()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        dirname = os.path.dirname(SPILL_PATH)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        conn = sqlite3.connect(SPILL_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spilled (
+                session_id TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                messages BLOB NOT NULL,
+                PRIMARY KEY (session_id, chunk)
+            ) WITHOUT ROWID
+            """
+        )
+        _conn = conn
+        atexit.register(_remove_spill_file)
+    return _conn
+
+
+def _remove_spill_file():
+    global _conn
+    with _lock:
+        if _conn is None:
+            return
+        _conn.close()
+        _conn = None
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(SPILL_PATH + suffix)
+        except OSError:
+            pass
+
+
+def _delete_session(session_id):
+    with _lock:
+        if _conn is not None:
+            _conn.execute("DELETE FROM spilled WHERE session_id = ?", (session_id,))
+
+
+class ChatHistory(list):
+    """List tin nhắn của một session, kèm ngữ cảnh hội thoại (chat_context) dựng dần từ nó."""
+
+    __slots__ = ("context",)
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.context = None
+
+
+def _messages_size(messages):
+    """Ước lượng số byte bộ nhớ của list tin nhắn (list, dict và chuỗi nội dung)."""
+    size = sys.getsizeof(messages)
+    for msg in messages:
+        size += sys.getsizeof(msg) + sum(sys.getsizeof(value) for value in msg.values())
+    return size
+
+
+class SessionStore:
+    """Lịch sử chat của một session.
+
+    messages là cửa sổ các tin nhắn gần nhất và là list được truyền cho router/agent;
+    list này giữ nguyên đối tượng suốt phiên, chỉ bị cắt bớt ở đầu khi đẩy lượt cũ ra đĩa.
+    """
+
+    def __init__(self, session_id, max_in_memory=MAX_IN_MEMORY, page_size=PAGE_SIZE):
+        self.session_id = session_id
+        self.max_in_memory = max(max_in_memory, 2)
+        self.page_size = page_size
+        self.messages = ChatHistory()
+        self.visible = page_size
+        self._spilled_chunks = 0
+        self._spilled_messages = 0
+        self._spilled_bytes = 0
+        self._older = []            # tin nhắn cũ đã nạp lại từ đĩa để hiển thị
+        self._loaded_chunks = 0
+        _stores.add(self)
+        weakref.finalize(self, _delete_session, session_id)
+
+    def append(self, role, content):
+        self.messages.append({"role": role, "content": content})
+        if len(self.messages) > self.max_in_memory:
+            self._spill()
+
+    def _spill(self):
+        # Đẩy nửa cũ của cửa sổ ra đĩa một lần để không phải ghi ở mỗi lượt
+        count = len(self.messages) - self.max_in_memory // 2
+        blob = zlib.compress(json.dumps(self.messages[:count], ensure_ascii=False).encode("utf-8"))
+        with _lock:
+            _connect().execute(
+                "INSERT OR REPLACE INTO spilled (session_id, chunk, messages) VALUES (?, ?, ?)",
+                (self.session_id, self._spilled_chunks, blob),
+            )
+        # Phần đã nạp lại không còn liền với cửa sổ: bỏ đi, page() sẽ nạp lại khi cần
+        self._older = []
+        self._loaded_chunks = 0
+        del self.messages[:count]
+        self._spilled_chunks += 1
+        self._spilled_messages += count
+        self._spilled_bytes += len(blob)
+
+    def _load_chunk(self, chunk):
+        with _lock:
+            row = _connect().execute(
+                "SELECT messages FROM spilled WHERE session_id = ? AND chunk = ?", (self.session_id, chunk)
+            ).fetchone()
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")) if row else []
+
+    def total(self):
+        return self._spilled_messages + len(self.messages)
+
+    def has_older(self):
+        return self.visible < self.total()
+
+    def load_older(self):
+        self.visible += self.page_size
+
+    def page(self):
+        """Các tin nhắn cần hiển thị: visible tin nhắn cuối cùng của cả cuộc hội thoại."""
+        need = min(self.visible, self.total()) - len(self.messages)
+        if need <= 0:
+            return self.messages[-self.visible:]
+        # Nạp ngược từng khối trên đĩa cho tới khi đủ số tin nhắn cần hiển thị
+        while len(self._older) < need and self._loaded_chunks < self._spilled_chunks:
+            chunk = self._spilled_chunks - self._loaded_chunks - 1
+            self._older[:0] = self._load_chunk(chunk)
+            self._loaded_chunks += 1
+        return self._older[-need:] + self.messages
+
+    def clear(self):
+        self.messages.clear()
+        self.visible = self.page_size
+        self._older = []
+        self._loaded_chunks = 0
+        self._spilled_chunks = self._spilled_messages = self._spilled_bytes = 0
+        _delete_session(self.session_id)
+
+    def memory_bytes(self):
+        context = self.messages.context
+        context_size = context.memory_bytes() if context is not None else 0
+        return _messages_size(self.messages) + _messages_size(self._older) + context_size
+
+    def stats(self):
+        return {
+            "messages": self.total(),
+            "in_memory": len(self.messages),
+            "reloaded": len(self._older),
+            "on_disk": self._spilled_messages,
+            "memory_kb": round(self.memory_bytes() / 1024, 1),
+            "disk_kb": round(self._spilled_bytes / 1024, 1),
+        }
+
+
+def memory_report():
+    """Bộ nhớ lịch sử chat của mọi session đang sống trong process (để ước lượng số replica)."""
+    sizes = [store.memory_bytes() for store in list(_stores)]
+    if not sizes:
+        return {"sessions": 0, "total_kb": 0.0, "mean_kb": 0.0, "max_kb": 0.0}
+    return {
+        "sessions": len(sizes),
+        "total_kb": round(sum(sizes) / 1024, 1),
+        "mean_kb": round(sum(sizes) / len(sizes) / 1024, 1),
+        "max_kb": round(max(sizes) / 1024, 1),
+    }
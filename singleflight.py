@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+import async_runtime
+import response_cache
+import tracing
+
+# Gộp các lời gọi giống nhau đang chạy cùng lúc (single-flight): khi nhiều session hỏi cùng
+# một cuốn sách, chỉ lời gọi đầu tiên đi ra ngoài, các lời gọi còn lại chờ và dùng chung kết quả.
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+class SingleFlight:
+    """Một nhóm lời gọi; lời gọi sync dùng Future của thread, lời gọi async dùng Task trên loop."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}        # key -> concurrent.futures.Future
+        self._tasks = {}        # (loop, key) -> asyncio.Task
+        self._stats = {"calls": 0, "upstream": 0, "coalesced": 0}
+
+    def _count(self, leader):
+        self._stats["calls"] += 1
+        self._stats["upstream" if leader else "coalesced"] += 1
+        if not leader:
+            span = tracing.current_span()
+            if span is not None:
+                span.set(coalesced=True)
+
+    def do(self, key, func, *args, **kwargs):
+        """Gọi func(*args) hoặc chờ lời gọi cùng key đang chạy ở thread khác."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            self._count(leader)
+        if not leader:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key, func, *args, **kwargs):
+        """Phiên bản async của do(): func trả về coroutine, chạy một lần cho mọi caller cùng key.
+
+        Caller bị hủy (người dùng bỏ lượt chat) không hủy lời gọi chung của các caller khác.
+        """
+        loop = asyncio.get_running_loop()
+        task_key = (loop, key)
+        with self._lock:
+            task = self._tasks.get(task_key)
+            leader = task is None
+            if leader:
+                task = self._tasks[task_key] = loop.create_task(func(*args, **kwargs))
+                task.add_done_callback(lambda _: self._forget(task_key))
+            self._count(leader)
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key):
+        with self._lock:
+            self._tasks.pop(task_key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["coalesced_rate"] = stats["coalesced"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+def group(name):
+    """Nhóm single-flight dùng chung theo tên (tạo khi cần)."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+async def run_blocking(func, *args):
+    """Như async_runtime.run_blocking nhưng gộp các lời gọi đồng thời cùng hàm và cùng tham số."""
+    flight = group(f"{func.__module__}.{func.__name__}")
+    return await flight.ado(response_cache.normalize_key(*args), async_runtime.run_blocking, func, *args)
+
+
+def coalescing_stats():
+    """Số lời gọi, số lời gọi thật sự đi ra ngoài và số lời gọi được gộp của từng nhóm."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {flight.name: flight.stats() for flight in groups}
@@ -1,30 +1,15 @@
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import async_runtime
+import runtime
+import tracing
+from chat_context import format_chat_history
 
-# Load API key from environment variables
-load_dotenv()
-genai.configure(api_key=os.getenv("API_KEY"))
+# Gemini model is created lazily and shared through runtime.get_gemini_model()
 
-# Initialize Gemini model
-model = genai.GenerativeModel("gemini-2.0-flash-lite")
-
-def format_chat_history(chat_history):
-    """Format conversation history as context for the Gemini model."""
-    if not chat_history:
-        return ""
-    
-    history_text = ""
-    for msg in chat_history[-6:]:  # Limiting to last 6 messages
-        role = "User" if msg["role"] == "user" else "Assistant"
-        history_text += f"{role}: {msg['content']}\n"
-    return history_text
-
-def small_talker(input_text: str, chat_history=None) -> str:
-    """Process user input and generate responses using Gemini AI."""
+def build_prompt(input_text: str, chat_history=None) -> str:
+    """Build the small-talk prompt with conversation history as context."""
     history_text = format_chat_history(chat_history) if chat_history else ""
     
-    prompt = f"""
+    return f"""
     You are an AI assistant engaged in casual conversation. Respond naturally and conversationally.
     
     Previous conversation history:
@@ -35,9 +20,24 @@ def small_talker(input_text: str, chat_history=None) -> str:
 
     Generate a thoughtful and engaging response:
     """
-    
+
+@tracing.traced("small_talk")
+async def asmall_talker(input_text: str, chat_history=None, stream=False):
+    """Process user input and generate responses using Gemini AI without blocking the event loop.
+
+    With stream=True an async iterator of text chunks is returned instead of a string.
+    """
     try:
-        response = model.generate_content(prompt)
+        response = await runtime.get_gemini_model().generate_content_async(build_prompt(input_text, chat_history), stream=stream)
+        if stream:
+            return async_runtime.stream_text(response, "Error generating response")
         return response.text.strip() if response else "I'm not sure how to respond."
     except Exception as e:
         return f"Error generating response: {str(e)}"
+
+def small_talker(input_text: str, chat_history=None, session_id=None, stream=False):
+    """Process user input and generate responses using Gemini AI.
+
+    With stream=True a generator of text chunks is returned instead of a string.
+    """
+    return async_runtime.run_streamable(asmall_talker(input_text, chat_history, stream), session_id)
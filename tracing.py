@@ -0,0 +1,281 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tracing theo lượt chat: mỗi giai đoạn (route, trích xuất, tra cứu, sinh câu trả lời...)
+# là một span lồng nhau. Thời gian của mọi span được đưa vào histogram kiểu Prometheus,
+# mỗi lượt được ghi một dòng vào file JSONL để phân tích sau.
+TRACE_LOG = os.getenv("TRACE_LOG", os.path.join(".cache", "traces.jsonl"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Bucket (giây) giống mặc định của thư viện client Prometheus, thêm 30s cho Gemini chậm
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MAX_SESSIONS = 1000
+
+_current = contextvars.ContextVar("tracing_span", default=None)
+_lock = threading.Lock()
+_histograms = {}
+_last_traces = {}
+_collectors = {}        # tên -> hàm trả về dict thống kê (cache, trích xuất...) để xuất ra /metrics
+_metrics_server = None
+
+
+class Span:
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.children = []
+        self.error = None
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.duration = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        observe(self.name, self.duration)
+
+    def to_dict(self, root_start=None):
+        root_start = self.start if root_start is None else root_start
+        data = {
+            "name": self.name,
+            "offset_ms": round((self.start - root_start) * 1000, 2),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 2),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict(root_start) for child in self.children]
+        return data
+
+
+class Histogram:
+    """Histogram tích lũy theo bucket cố định (giống kiểu histogram của Prometheus)."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+def observe(stage, seconds):
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, **attrs):
+    """Tạo span con của span hiện tại mà không đổi ngữ cảnh (dùng cho stream/async generator).
+
+    Người gọi phải tự gọi span.finish().
+    """
+    return Span(name, _current.get(), **attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Đo một giai đoạn; span lồng trong span đang mở (kể cả qua async_runtime) thành span con."""
+    current = Span(name, _current.get(), **attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.finish(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.finish()
+
+
+def traced(name=None):
+    """Decorator bọc hàm (sync hoặc async) trong một span."""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace(name, session_id=None, **attrs):
+    """Span gốc của một lượt chat; khi kết thúc sẽ ghi trace vào TRACE_LOG."""
+    token = _current.set(None)
+    try:
+        with span(name, **attrs) as root:
+            yield root
+    finally:
+        _current.reset(token)
+        record = {"trace_id": uuid.uuid4().hex, "session_id": session_id,
+                  "timestamp": root.wall_start, **root.to_dict()}
+        with _lock:
+            _last_traces[session_id] = record
+            while len(_last_traces) > MAX_SESSIONS:
+                del _last_traces[next(iter(_last_traces))]
+        _write(record)
+
+
+def _write(record):
+    if not TRACE_LOG:
+        return
+    try:
+        dirname = os.path.dirname(TRACE_LOG)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with _lock, open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"[WARN] could not write trace: {e}")
+
+
+def last_trace(session_id=None):
+    with _lock:
+        return _last_traces.get(session_id)
+
+
+def breakdown(record):
+    """Làm phẳng cây span thành các dòng {"stage", "start_ms", "duration_ms"} để hiển thị."""
+    rows = []
+
+    def walk(node, depth):
+        rows.append({
+            "stage": "  " * depth + node["name"] + (" (error)" if node.get("error") else ""),
+            "start_ms": node["offset_ms"],
+            "duration_ms": node["duration_ms"],
+        })
+        for child in node.get("children", []):
+            walk(child, depth + 1)
+
+    if record:
+        walk(record, 0)
+    return rows
+
+
+def register_stats(name, collect):
+    """Đăng ký collect() -> {stat: số} hoặc {nhóm: {stat: số}}; được xuất thành gauge chatbot_<name>_<stat>."""
+    with _lock:
+        _collectors[name] = collect
+
+
+def collected_stats():
+    """Kết quả hiện tại của mọi collector đã đăng ký (cho bảng debug)."""
+    with _lock:
+        collectors = dict(_collectors)
+    results = {}
+    for name, collect in sorted(collectors.items()):
+        try:
+            results[name] = collect()
+        except Exception as e:
+            print(f"[WARN] stats collector {name} failed: {e}")
+    return results
+
+
+def _stat_lines():
+    families = {}
+    for name, stats in collected_stats().items():
+        for key, value in stats.items():
+            # Thống kê lồng nhau (theo namespace/nhóm) thành label "group"
+            items = value.items() if isinstance(value, dict) else [(key, value)]
+            label = str(key).replace("\\", "\\\\").replace('"', '\\"')
+            group = f'{{group="{label}"}}' if isinstance(value, dict) else ""
+            for stat, number in items:
+                if isinstance(number, (int, float)) and not isinstance(number, bool):
+                    families.setdefault(f"chatbot_{name}_{stat}", []).append(f"{group} {number}")
+    lines = []
+    for metric, samples in sorted(families.items()):
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(metric + sample for sample in samples)
+    return lines
+
+
+def prometheus_text():
+    """Histogram theo từng giai đoạn và thống kê đã đăng ký, ở định dạng text exposition của Prometheus."""
+    lines = [
+        "# HELP chatbot_stage_duration_seconds Duration of each traced stage of a chat turn.",
+        "# TYPE chatbot_stage_duration_seconds histogram",
+    ]
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            label = stage.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'chatbot_stage_duration_seconds_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'chatbot_stage_duration_seconds_bucket{{stage="{label}",le="+Inf"}} {histogram.count}')
+            lines.append(f'chatbot_stage_duration_seconds_sum{{stage="{label}"}} {histogram.sum:.6f}')
+            lines.append(f'chatbot_stage_duration_seconds_count{{stage="{label}"}} {histogram.count}')
+    lines.extend(_stat_lines())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Mở endpoint /metrics cho Prometheus scrape (chỉ một lần mỗi process, bỏ qua nếu port = 0)."""
+    global _metrics_server
+    with _lock:
+        if _metrics_server is not None or not port:
+            return _metrics_server
+        try:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            print(f"[WARN] metrics server not started: {e}")
+            return None
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+    return _metrics_server